@@ -1,13 +1,36 @@
 #!/usr/bin/python3
 import argparse
+import bz2
 import collections
+import collections.abc
+import concurrent.futures
 import datetime
+import fnmatch
+import functools
+import glob
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import mmap
+import os
+import queue
 import re
+import stat
+import subprocess
 import sys
 import tempfile
+import threading
+import time
 
 import numpy as np
 
+try:
+    from multiprocessing import shared_memory
+except ImportError:     # Python < 3.8
+    shared_memory = None
+
 class Model:
     def __init__(self):
         self.assembly = None
@@ -70,15 +93,18 @@ class Element():
     id = 0
     type = None
 
-    def __init__(self):
-        self.node = []
+    def __init__(self, id=0, type=None, node=None):
+        self.id = id
+        self.type = type
+        self.node = [] if node is None else node
 
 class Node():
     id = 0
     pos = None
 
-    def __init__(self):
-        self.pos = np.zeros(3)
+    def __init__(self, id=0, pos=None):
+        self.id = id
+        self.pos = np.zeros(3) if pos is None else pos
 
 class Section():
     elset = None
@@ -87,25 +113,353 @@ class Section():
 class Part():
     id = 0
 
-class Set(list):
+class Set():
+    """set of node or element labels, in the order they were given
+
+    Members are stored as a list of segments, each either a `range` (from
+    a generate= data line) or an int array of explicit labels, so a
+    generated set costs the same whatever its size.  Length, iteration and
+    membership tests work on the segments without expanding them.
+    Duplicated labels are kept, as in the input file.
+
+    """
     name = None
     instance = None
     part = None
 
+    def __init__(self, members=()):
+        self.segments = []
+        self._sorted = None
+        self.extend(members)
+
+    def add_range(self, start, stop, step=1):
+        """add labels start, start+step, ... up to and including stop"""
+        self.segments.append(range(start, stop + (1 if step > 0 else -1), step))
+        self._sorted = None
+
+    def extend(self, members):
+        if isinstance(members, range):
+            self.segments.append(members)
+        else:
+            members = np.asarray(members, dtype=np.int64).ravel()
+            if members.size:
+                self.segments.append(members)
+        self._sorted = None
+
+    def append(self, member):
+        self.extend([member])
+
+    def __len__(self):
+        return sum(len(i) for i in self.segments)
+
+    def __iter__(self):
+        for segment in self.segments:
+            if isinstance(segment, range):
+                yield from segment
+            else:
+                yield from segment.tolist()
+
+    def _explicit(self):
+        """sorted unique explicit (non-range) members"""
+        if self._sorted is None:
+            arrays = [i for i in self.segments if not isinstance(i, range)]
+            if arrays:
+                self._sorted = np.unique(np.concatenate(arrays))
+            else:
+                self._sorted = np.zeros(0, dtype=np.int64)
+        return self._sorted
+
+    def __contains__(self, member):
+        for segment in self.segments:
+            if isinstance(segment, range) and member in segment:
+                return True
+        explicit = self._explicit()
+        i = np.searchsorted(explicit, member)
+        return bool(i < len(explicit) and explicit[i] == member)
+
+    def contains(self, members):
+        """vectorized membership test; a boolean array shaped like `members`"""
+        members = np.asarray(members, dtype=np.int64)
+        ret = np.isin(members, self._explicit())
+        for segment in self.segments:
+            if not isinstance(segment, range) or not segment:
+                continue
+            if segment.step < 0:
+                segment = segment[::-1]
+            ret |= ((members >= segment.start) & (members < segment.stop) &
+                    ((members - segment.start) % segment.step == 0))
+        return ret
+
+    def to_array(self):
+        """all members, in order, as an int array"""
+        arrays = [np.arange(i.start, i.stop, i.step, dtype=np.int64)
+                  if isinstance(i, range) else i for i in self.segments]
+        if not arrays:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(arrays)
+
+class IdIndex():
+    """maps entity labels to rows of a columnar array
+
+    Dense labels (the usual case) get a direct-address table; sparse
+    labels are looked up with a binary search over the sorted labels.
+    When a label appears more than once, its last row is found.
+
+    """
+
+    def __init__(self, ids):
+        self.size = len(ids)
+        self.table = None
+        if self.size == 0:
+            self.sorted = ids
+            self.order = ids
+            return
+        lo = int(ids.min())
+        hi = int(ids.max())
+        if lo >= 0 and hi < 4 * self.size + 1024:
+            self.table = np.full(hi + 1, -1, dtype=np.int64)
+            self.table[ids] = np.arange(self.size)
+        else:
+            self.order = np.argsort(ids, kind='stable')
+            self.sorted = ids[self.order]
+
+    def rows(self, ids):
+        """rows of an array of labels; -1 where a label is unknown"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.table is not None:
+            ret = np.full(ids.shape, -1, dtype=np.int64)
+            valid = (ids >= 0) & (ids < len(self.table))
+            ret[valid] = self.table[ids[valid]]
+            return ret
+        pos = np.searchsorted(self.sorted, ids, side='right') - 1
+        found = (pos >= 0) & (self.sorted[np.maximum(pos, 0)] == ids)
+        return np.where(found, self.order[np.maximum(pos, 0)], -1)
+
+    def row(self, id):
+        """row of a single label, raising KeyError if unknown"""
+        if self.table is not None:
+            if 0 <= id < len(self.table):
+                row = int(self.table[id])
+                if row >= 0:
+                    return row
+            raise KeyError(id)
+        row = int(self.rows([id])[0])
+        if row < 0:
+            raise KeyError(id)
+        return row
+
+class NodeView(collections.abc.Mapping):
+    """read-only label -> Node mapping over the columns of an AbaqusPart
+
+    The Node objects are created on access; their `pos` is a view into the
+    part's coordinate array.
+
+    """
+
+    def __init__(self, part):
+        self.part = part
+
+    def __getitem__(self, id):
+        part = self.part
+        return Node(id, part.node_pos[part.node_index.row(id)])
+
+    def __iter__(self):
+        return iter(self.part.node_id.tolist())
+
+    def __len__(self):
+        return len(self.part.node_id)
+
+    def values(self):
+        pos = self.part.node_pos
+        for row, id in enumerate(self.part.node_id.tolist()):
+            yield Node(id, pos[row])
+
+class ElementView(collections.abc.Mapping):
+    """read-only label -> Element mapping over the columns of an AbaqusPart"""
+
+    def __init__(self, part):
+        self.part = part
+
+    def _element(self, row, id):
+        part = self.part
+        code = part.element_type[row]
+        node = part.element_node[row, :part.element_type_nodes[code]]
+        return Element(id, part.element_types[code], node.tolist())
+
+    def __getitem__(self, id):
+        return self._element(self.part.element_index.row(id), id)
+
+    def __iter__(self):
+        return iter(self.part.element_id.tolist())
+
+    def __len__(self):
+        return len(self.part.element_id)
+
+    def values(self):
+        for row, id in enumerate(self.part.element_id.tolist()):
+            yield self._element(row, id)
+
 class AbaqusPart(Part):
+    """columnar storage of the nodes and elements of a part
+
+    Nodes are held in `node_id` (N,) and `node_pos` (N,3); elements in
+    `element_id` (E,), `element_node` (E,n) and `element_type` (E,).  The
+    connectivity is as wide as the widest element type, and padded with 0.
+    `element_type` holds codes into `element_types` (type names) and
+    `element_type_nodes` (nodes per type).  `node` and `element` offer the
+    former label -> object mappings as views over these arrays.
+
+    Blocks added while parsing are joined on first access to a column.
+
+    """
     orientation = None
     set = None
     section = None
 
     def __init__(self, name):
         self.name = name
-        self.element = {}
-        self.node = {}
         self.set = {}
         self.set['node'] = {}
         self.set['element'] = {}
         self.section = []
         self.orientation = {}
+        self.element_types = []
+        self.element_type_nodes = []
+        self._node_blocks = []
+        self._element_blocks = []
+        self._columns = {
+            'node_id': np.zeros(0, dtype=np.int64),
+            'node_pos': np.zeros((0, 3)),
+            'element_id': np.zeros(0, dtype=np.int64),
+            'element_node': np.zeros((0, 0), dtype=np.int64),
+            'element_type': np.zeros(0, dtype=np.int16),
+            }
+        self._index = {}
+        self.node = NodeView(self)
+        self.element = ElementView(self)
+
+    def add_nodes(self, ids, pos):
+        """add a block of nodes from an (N,) id and an (N,3) position array"""
+        self._node_blocks.append((ids, pos))
+        self._index.pop('node', None)
+
+    def add_elements(self, type, ids, connectivity):
+        """add a block of elements of one type
+
+        `ids` is an (E,) array of element labels and `connectivity` an (E,n)
+        array of node labels, n being the number of nodes of `type`.
+
+        """
+        if type in self.element_types:
+            code = self.element_types.index(type)
+        else:
+            code = len(self.element_types)
+            self.element_types.append(type)
+            self.element_type_nodes.append(connectivity.shape[1])
+        self._element_blocks.append((code, ids, connectivity))
+        self._index.pop('element', None)
+        self._index.pop('section', None)
+
+    def _join_nodes(self):
+        old = self._columns
+        blocks = [(old['node_id'], old['node_pos'])] + self._node_blocks
+        self._node_blocks = []
+        old['node_id'] = np.concatenate([i[0] for i in blocks])
+        old['node_pos'] = np.concatenate([i[1] for i in blocks])
+
+    def _join_elements(self):
+        blocks = self._element_blocks
+        self._element_blocks = []
+        old = self._columns
+        width = max([old['element_node'].shape[1]] +
+                    [i[2].shape[1] for i in blocks])
+        size = len(old['element_id']) + sum(len(i[1]) for i in blocks)
+        node = np.zeros((size, width), dtype=np.int64)
+        node[:len(old['element_id']), :old['element_node'].shape[1]] = \
+            old['element_node']
+        row = len(old['element_id'])
+        for code, ids, connectivity in blocks:
+            node[row:row + len(ids), :connectivity.shape[1]] = connectivity
+            row += len(ids)
+        old['element_node'] = node
+        old['element_id'] = np.concatenate(
+            [old['element_id']] + [i[1] for i in blocks])
+        old['element_type'] = np.concatenate(
+            [old['element_type']] +
+            [np.full(len(i[1]), i[0], dtype=np.int16) for i in blocks])
+
+    def _column(self, name):
+        if name.startswith('node') and self._node_blocks:
+            self._join_nodes()
+        if name.startswith('element') and self._element_blocks:
+            self._join_elements()
+        return self._columns[name]
+
+    node_id = property(lambda self: self._column('node_id'))
+    node_pos = property(lambda self: self._column('node_pos'))
+    element_id = property(lambda self: self._column('element_id'))
+    element_node = property(lambda self: self._column('element_node'))
+    element_type = property(lambda self: self._column('element_type'))
+
+    @property
+    def node_index(self):
+        """IdIndex of the node labels"""
+        if 'node' not in self._index:
+            self._index['node'] = IdIndex(self.node_id)
+        return self._index['node']
+
+    @property
+    def element_index(self):
+        """IdIndex of the element labels"""
+        if 'element' not in self._index:
+            self._index['element'] = IdIndex(self.element_id)
+        return self._index['element']
+
+    @property
+    def element_section(self):
+        """(E,) index into `section` of each element's section, or -1
+
+        When an element is in the elsets of several sections the last one
+        wins.  Computed once, on first access after parsing.
+
+        """
+        if 'section' not in self._index:
+            ret = np.full(len(self.element_id), -1, dtype=np.int64)
+            for k, section in enumerate(self.section):
+                elset = self.set['element'][section.elset]
+                ret[elset.contains(self.element_id)] = k
+            self._index['section'] = ret
+        return self._index['section']
+
+    def element_centroids(self, rows=slice(None)):
+        """(n,3) centroids of the elements in `rows`"""
+        node = self.element_node[rows]
+        nnode = np.array(self.element_type_nodes)[self.element_type[rows]]
+        used = np.arange(node.shape[1]) < nnode[:, None]
+        pos = self.node_pos[self.node_index.rows(node)]
+        pos[~used] = 0
+        return pos.sum(axis=1) / nnode[:, None]
+
+    def element_axes(self, instance, start, stop):
+        """orthotropic a and d vectors (n,3) of the elements start:stop
+
+        Every element in the range must have an oriented section.  The
+        vectors are computed in one batch per orientation.
+
+        """
+        section = self.element_section[start:stop]
+        a = np.empty((stop - start, 3))
+        d = np.empty((stop - start, 3))
+        for k in np.unique(section).tolist():
+            rows = np.flatnonzero(section == k)
+            orient = self.orientation[self.section[k].orientation]
+            if orient.system == 'CYLINDRICAL':
+                centroids = self.element_centroids(rows + start)
+            else:
+                # rectangular axes are the same everywhere
+                centroids = np.zeros((len(rows), 3))
+            a[rows], d[rows] = orthotropic_axes(orient, centroids, instance)
+        return a, d
 
 def GetRotationMatrix(a,b,th):
     ux = b[0] - a[0]
@@ -127,6 +481,30 @@ def GetRotationMatrix(a,b,th):
     rm[2,2] = cos + uz**2*one_cos
     return rm
 
+def GetRotationMatrices(u, th):
+    """rotation matrices (n,3,3) about each of the axes (n,3) in `u`
+
+    The batched form of GetRotationMatrix([0,0,0], u[i], th).
+
+    """
+    u = np.asarray(u, dtype=float)
+    ux, uy, uz = u[:, 0], u[:, 1], u[:, 2]
+    rm = np.empty((len(u), 3, 3))
+    th = th * np.pi/180.
+    cos = np.cos(th)
+    sin = np.sin(th)
+    one_cos = 1-cos
+    rm[:,0,0] = cos + ux**2*one_cos
+    rm[:,0,1] = ux*uy*one_cos - uz*sin
+    rm[:,0,2] = ux*uz*one_cos + uy*sin
+    rm[:,1,0] = uy*ux*one_cos + uz*sin
+    rm[:,1,1] = cos + uy**2*one_cos
+    rm[:,1,2] = uy*uz*one_cos - ux*sin
+    rm[:,2,0] = uz*ux*one_cos - uy*sin
+    rm[:,2,1] = uz*uy*one_cos + ux*sin
+    rm[:,2,2] = cos + uz**2*one_cos
+    return rm
+
 class AbaqusInstance():
     name = None
     part = None
@@ -141,6 +519,21 @@ class AbaqusInstance():
         rm = GetRotationMatrix(a,b,th)
         return rm
 
+    @property
+    def rotated(self):
+        return not np.array_equal(self.rotation_matrix, np.eye(3))
+
+    def transform(self, pos):
+        """move an (N,3) array of part coordinates to this instance
+
+        The whole array is rotated and translated at once; the rotation is
+        skipped when the instance is not rotated.
+
+        """
+        if self.rotated:
+            pos = pos @ self.rotation_matrix.T
+        return pos + self.translation
+
     def __init__(self):
         self.translation = np.zeros(3)
         self.rotation = {}
@@ -157,435 +550,1914 @@ class AbaqusInput():
         self.set = {}
         self.set['node'] = {}
         self.set['element'] = {}
+        # assembly sets grouped by instance, in the order of `set`
+        self.set_by_instance = {}
+        self.set_by_instance['node'] = {}
+        self.set_by_instance['element'] = {}
+
+    def add_set(self, type, s):
+        """add an assembly set of `type` 'node' or 'element'"""
+        old = self.set[type].get(s.name)
+        if old is not None and old.instance != s.instance:
+            del self.set_by_instance[type][old.instance][s.name]
+        self.set[type][s.name] = s
+        self.set_by_instance[type].setdefault(s.instance, {})[s.name] = s
+
+    def instance_sets(self, type, instance):
+        """(name, Set) pairs of the assembly sets of an instance"""
+        return self.set_by_instance[type].get(instance, {}).items()
+
+class Progress():
+    """throttled progress reporting for the parser and the writer
+
+    `update` may be called as often as convenient; a report is made at most
+    every `interval` seconds.  Reports go to `callback(progress)` when one
+    is given, otherwise to `stream` (stderr by default) as a single status
+    line, which is only done when the stream is a terminal.  Throughput is
+    shown per `unit` and, when a byte count is given, in MB/s; the ETA
+    needs a `total`.
+
+    """
+
+    def __init__(self, label, total=None, unit='items', interval=0.2,
+                 stream=None, callback=None):
+        self.interval = interval
+        self.stream = sys.stderr if stream is None else stream
+        self.callback = callback
+        self.restart(label, total, unit)
+        if callback is not None:
+            self.enabled = True
+        else:
+            try:
+                self.enabled = self.stream.isatty()
+            except (AttributeError, ValueError):
+                self.enabled = False
+
+    @classmethod
+    def create(cls, progress, label, total=None, unit='items'):
+        """Progress from a `progress` argument of the parser or writer
+
+        None reports to a terminal on stderr, False disables reporting, a
+        callable is used as callback and a Progress is used as given.
+
+        """
+        if isinstance(progress, Progress):
+            progress.restart(label, total, unit)
+            return progress
+        ret = cls(label, total, unit,
+                  callback=progress if callable(progress) else None)
+        if progress is False:
+            ret.enabled = False
+        return ret
+
+    def restart(self, label, total=None, unit='items'):
+        """start reporting a new stage, counting from zero and now"""
+        self.label = label
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.bytes = None
+        self.finished = False
+        self.start = time.monotonic()
+        self.last = self.start
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    @property
+    def fraction(self):
+        """completed fraction of the total, None if the total is unknown"""
+        done = self.done if self.bytes is None else self.bytes
+        if not self.total:
+            return None
+        return min(done * 1.0 / self.total, 1)
+
+    @property
+    def eta(self):
+        """estimated seconds remaining, None if unknown"""
+        fraction = self.fraction
+        if not fraction:
+            return None
+        return self.elapsed * (1 - fraction) / fraction
+
+    def update(self, done, bytes=None):
+        """record progress; `total` is measured in bytes if they are given"""
+        if not self.enabled:
+            return
+        self.done = done
+        self.bytes = bytes
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def finish(self):
+        if not self.enabled:
+            return
+        self.finished = True
+        if self.total:
+            self.bytes = None if self.bytes is None else self.total
+        self.report()
+
+    def report(self):
+        if self.callback is not None:
+            self.callback(self)
+            return
+        elapsed = max(self.elapsed, 1e-9)
+        status = []
+        if self.finished:
+            status.append('done in {:.1f}s'.format(elapsed))
+        elif self.fraction is not None:
+            status.append('{:3.0f}%'.format(100 * self.fraction))
+        status.append('{:.3g} {}/s'.format(self.done / elapsed, self.unit))
+        if self.bytes is not None:
+            status.append('{:.1f} MB/s'.format(self.bytes / elapsed / 1e6))
+        if not self.finished and self.eta is not None:
+            status.append('ETA {:.0f}s'.format(self.eta))
+        end = '\n' if self.finished else '\r'
+        self.stream.write('\x1b[2K' + self.label + ': ' + ', '.join(status) + end)
+        self.stream.flush()
 
 # parse Abaqus input file
 
-def ParseAbaqus(file):
-    ret = AbaqusInput()
-    count = collections.Counter()
-
-    regex = {}
-    regex['comment'] = re.compile(r'^\*\*')
-    regex['keyword'] = re.compile(r'^\*[a-zA-Z0-9 ]+[,\n]')
-    regex['data'] = re.compile(r'^(?!\*)')
-
-    line_counter = collections.Counter()
-    line_counter['total'] = len(file.readlines())
-    file.seek(0)
-
-    def ends_at(kw,loc):
-        if loc == '*':
-            if section[len(section)-1] != kw:
-                section.pop(section.index(kw))
-        if type(loc) is int:
-            if count['keyword_line'] == loc:
-                section.pop(section.index(kw))
-        if type(loc) is str:
-            if loc in section:
-                section.pop(section.index(kw))
-
-    def update_term(complete=False):
-        total = line_counter['total']
-        count = line_counter['current']
-        perc = int(100 * count * 1.0 / total)
-        old_perc = int(100 * (count-1)*1.0/total)
-        if perc != old_perc or count == 1 or perc == 1:
-            perc = count * 1.0 / total
-            #import pdb; pdb.set_trace()
-            fmt = 'Parsing ({:3.0f}% complete)'.format(100*perc)
-            if complete:
-                to_write = fmt + '...done!\n'
-                sys.stdout.write(to_write)
+def _plain_file(file):
+    """whether a stream reads an OS file directly, not through a
+    decompressor say"""
+    raw = file
+    for attr in ('buffer', 'raw'):
+        raw = getattr(raw, attr, raw)
+    return isinstance(raw, io.FileIO)
+
+def _stream_path(file):
+    """path of the file a stream reads, or None
+
+    The `name` of a stream is only taken as a path when it names the file
+    open in the stream; standard input, pipes and in-memory streams have
+    none.
+
+    """
+    name = getattr(file, 'name', None)
+    if not isinstance(name, str):
+        return None
+    try:
+        if os.path.samestat(os.stat(name), os.fstat(file.fileno())):
+            return name
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
+
+def _stream_size(file):
+    """size in bytes of the file behind a stream, or None if unknown
+
+    Pipes, sockets, in-memory and decompressed streams have no meaningful
+    size; the parser must then run without a percentage.
+
+    """
+    if not _plain_file(file):
+        return None
+    try:
+        size = os.fstat(file.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return None
+    try:
+        size -= file.tell()
+    except (AttributeError, OSError, ValueError):
+        pass
+    return size if size > 0 else None
+
+# keyword dispatch
+#
+# Each keyword block of the input file is handed to a KeywordHandler looked up
+# once, on the keyword line, in KEYWORD_HANDLERS.  Data lines then go straight
+# to the handler, so the parse loop does no per-line keyword comparisons.
+
+KEYWORD_HANDLERS = {}
+
+def register_keyword(*keywords):
+    """class decorator adding a KeywordHandler to the dispatch table
+
+    Keywords are matched case-insensitively against the keyword name with
+    its parameters removed, e.g. 'NODE' or 'SOLID SECTION'.  Registering a
+    keyword that is already known replaces its handler.
+
+    """
+    def decorator(cls):
+        for keyword in keywords:
+            KEYWORD_HANDLERS[keyword.upper()] = cls
+        return cls
+    return decorator
+
+def get_keyword_handler(keyword):
+    """handler class for a keyword name (upper case)"""
+    try:
+        return KEYWORD_HANDLERS[keyword]
+    except KeyError:
+        pass
+    if 'SECTION' in keyword:
+        return SectionHandler
+    return KeywordHandler
+
+class AbaqusParser():
+    """state shared by the keyword handlers while parsing"""
+
+    # smallest block, in bytes, converted in a worker process
+    min_block = 1 << 20
+
+    def __init__(self, model=None):
+        if model is None:
+            model = AbaqusInput()
+        self.model = model
+        self.part = None
+        self.instance = None
+        self.in_assembly = False
+        # decoding of the memory mapped input
+        self.encoding = 'utf-8'
+        self.errors = 'strict'
+        # conversion of large blocks of the mapped file `source` in `pool`;
+        # `offset` is that of the chunk being passed to a handler's block
+        self.pool = None
+        self.source = None
+        self.offset = 0
+        self.pending = []
+
+    def convert(self, done, function, lines, ranges, *args):
+        """call done(*function(lines, *args)), perhaps in a worker process
+
+        Blocks of at least `min_block` bytes of a mapped file are converted
+        in `pool` when there is one, reading the byte `ranges` of the file
+        again there.  Results are then handed to `done` in the order of the
+        calls, by `finish`.
+
+        """
+        if self.pool is not None and sum(i[1] for i in ranges) >= \
+                self.min_block:
+            result = self.pool.submit(_convert_ranges, self.source, ranges,
+                                      function, *args)
+        elif self.pending:
+            # keep the order of the blocks still being converted
+            result = function(lines, *args)
+        else:
+            done(*function(lines, *args))
+            return
+        self.pending.append((done, result))
+
+    def finish(self):
+        """hand the results of pending conversions to their `done`"""
+        pending = self.pending
+        self.pending = []
+        for done, result in pending:
+            if isinstance(result, concurrent.futures.Future):
+                result = result.result()
+            done(*result)
+
+def _convert_ranges(source, ranges, function, *args):
+    """function(chunks, *args) of the byte ranges of a file; see convert"""
+    with open(source, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            chunks = [buf[start:start + size] for start, size in ranges]
+    return function(chunks, *args)
+
+class KeywordHandler():
+    """handles one keyword block of an Abaqus input file
+
+    A new handler is created for each keyword line.  `begin` receives the
+    keyword parameters, `data` is called with every data line of the block
+    and `end` once the block is closed by the next keyword or the end of
+    the file.  The base class ignores the block, and is used for keywords
+    without a registered handler.
+
+    When the input is memory mapped, the data lines arrive instead as
+    bytes-like chunks of the file, each holding one or more whole lines, by
+    `block`.  By default these are decoded and split into lines for `data`;
+    bulk handlers collect the chunks undecoded.
+
+    """
+
+    def __init__(self, parser, keyword):
+        self.parser = parser
+        self.model = parser.model
+        self.keyword = keyword
+        self.kwargs = {}
+
+    def begin(self, kwargs):
+        self.kwargs = kwargs
+
+    def data(self, line):
+        pass
+
+    def block(self, chunk):
+        text = bytes(chunk).decode(self.parser.encoding, self.parser.errors)
+        for line in io.StringIO(text, newline=None):
+            self.data(line)
+
+    def end(self):
+        pass
+
+@register_keyword('PART')
+class PartHandler(KeywordHandler):
+    def begin(self, kwargs):
+        name = kwargs['name']
+        self.model.part[name] = AbaqusPart(name)
+        self.parser.part = name
+
+@register_keyword('END PART')
+class EndPartHandler(KeywordHandler):
+    def begin(self, kwargs):
+        self.parser.part = None
+
+@register_keyword('ASSEMBLY')
+class AssemblyHandler(KeywordHandler):
+    def begin(self, kwargs):
+        self.parser.in_assembly = True
+
+@register_keyword('END ASSEMBLY')
+class EndAssemblyHandler(KeywordHandler):
+    def begin(self, kwargs):
+        self.parser.in_assembly = False
+
+@register_keyword('INSTANCE')
+class InstanceHandler(KeywordHandler):
+    def begin(self, kwargs):
+        instance = AbaqusInstance()
+        instance.name = kwargs['name']
+        instance.part = kwargs['part']
+        self.instance = instance
+        self.line = 0
+        self.model.instance[instance.name] = instance
+        self.parser.instance = instance.name
+
+    def data(self, line):
+        self.line += 1
+        parts = line.split(',')
+        if self.line == 1:
+            self.instance.translation[:] = parts
+        elif self.line == 2:
+            self.instance.rotation['a'][:] = parts[0:3]
+            self.instance.rotation['b'][:] = parts[3:6]
+            self.instance.rotation['deg'] = float(parts[6])
+
+@register_keyword('END INSTANCE')
+class EndInstanceHandler(KeywordHandler):
+    def begin(self, kwargs):
+        self.parser.instance = None
+
+@register_keyword('ORIENTATION')
+class OrientationHandler(KeywordHandler):
+    def begin(self, kwargs):
+        orient = Orientation()
+        orient.name = kwargs['name']
+        orient.system = kwargs.get('system', 'RECTANGULAR')
+        self.orient = orient
+        self.line = 0
+        self.model.part[self.parser.part].orientation[orient.name] = orient
+
+    def data(self, line):
+        self.line += 1
+        parts = line.split(',')
+        if self.line == 1:
+            self.orient.a[:] = parts[0:3]
+            self.orient.b[:] = parts[3:6]
+            if len(parts) == 9:
+                self.orient.c[:] = parts[6:9]
+        elif self.line == 2:
+            self.orient.rot_axis = int(parts[0])
+            self.orient.rot = float(parts[1])
+
+class SectionHandler(KeywordHandler):
+    """any *... SECTION keyword; only oriented sections are recorded"""
+
+    def begin(self, kwargs):
+        if 'orientation' in kwargs:
+            section = Section()
+            section.elset = kwargs['elset']
+            section.orientation = kwargs['orientation']
+            self.model.part[self.parser.part].section.append(section)
+
+def _join_block(lines):
+    """(text, first line, line count) of the data of a keyword block
+
+    `lines` are either str lines or bytes-like chunks of whole lines of a
+    memory mapped file.  Chunks are joined to bytes, not decoded, and their
+    line ends are made '\n' as in a file read as text.
+
+    """
+    if isinstance(lines[0], str):
+        return ''.join(lines), lines[0], len(lines)
+    text = b''.join(lines)
+    if b'\r' in text:
+        text = text.replace(b'\r\n', b'\n')
+    end = text.find(b'\n')
+    first = text if end < 0 else text[:end]
+    return text, first, text.count(b'\n') + (not text.endswith(b'\n'))
+
+def _block_lines(text):
+    """str lines of a text returned by _join_block"""
+    if isinstance(text, bytes):
+        text = text.decode('latin-1')
+    return text.splitlines(True)
+
+def _skip_blanks(buf, pos):
+    """positions of the first non blank byte of `buf` at or after `pos`"""
+    pos = pos.copy()
+    todo = np.arange(len(pos))
+    while len(todo):
+        c = buf[pos[todo]]
+        todo = todo[(c == 32) | (c == 9) | (c == 13)]
+        pos[todo] += 1
+    return pos
+
+def _split_fields(text):
+    """(values, fields per line, line ends with a comma) of a block text
+
+    `text` is returned by _join_block.  A comma ending a line (before any
+    blanks) continues the record on the next line and does not start a
+    field of its own.  Returns None when a field is empty or not a number,
+    blank lines included, which np.fromstring would either reject or
+    silently read as -1.
+
+    """
+    if isinstance(text, str):
+        text = text.encode('latin-1', 'replace')
+    if not text.endswith(b'\n'):
+        text += b'\n'
+    buf = np.frombuffer(text, np.uint8)
+    ends = np.flatnonzero(buf == 10)
+    commas = np.flatnonzero(buf == 44)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    first = buf[_skip_blanks(buf, starts)]
+    if ((first == 10) | (first == 44)).any():
+        return None
+    after = buf[_skip_blanks(buf, commas + 1)]
+    if (after == 44).any():
+        return None
+    trailing = commas[after == 10]
+    continued = np.diff(np.searchsorted(trailing, ends), prepend=0) > 0
+    fields = np.diff(np.searchsorted(commas, ends), prepend=0) + 1 - continued
+    joined = buf.copy()
+    joined[trailing] = 32
+    joined[ends] = 44
+    try:
+        values = np.fromstring(joined.tobytes(), sep=',')
+    except ValueError:
+        return None
+    if values.size != fields.sum():
+        return None
+    return values, fields, continued
+
+def _parse_records(lines, width=None):
+    """parse the comma separated numeric data lines of a keyword block
+
+    Returns a float array with one row of `width` fields per record.  When
+    `width` is None each line holds exactly one record, and the width is
+    that of the longest line.  Otherwise a line ending with a comma
+    continues the record on the next one while it has fewer than `width`
+    fields.  The whole block is converted by a single np.fromstring call;
+    only blocks that do not split into such records (short lines, blank
+    lines) fall back to line by line parsing, where missing trailing fields
+    are filled with 0.  `lines` may also be chunks of a mapped file, see
+    _join_block.
+
+    """
+    if not lines:
+        return np.zeros((0, width or 0))
+    text = _join_block(lines)[0]
+    split = _split_fields(text)
+    if width is None:
+        if split is not None and (split[1] == split[1][0]).all():
+            return split[0].reshape(-1, split[1][0])
+        return _parse_records_by_line(_block_lines(text), 0, False)
+    if split is not None:
+        values, fields, continued = split
+        # each line lies within one record, and only ends before the end
+        # of its record when it ends with a comma
+        end = np.cumsum(fields)
+        if (end[-1] % width == 0
+                and ((end - fields) // width == (end - 1) // width).all()
+                and ((end % width == 0) | continued).all()):
+            return values.reshape(-1, width)
+    return _parse_records_by_line(_block_lines(text), width)
+
+def _parse_records_by_line(lines, width, fixed=True):
+    """_parse_records of str lines; a record per line unless `fixed`"""
+    records = []
+    record = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        fields = line.split(',')
+        continued = fields[-1].strip() == ''
+        if continued:
+            fields.pop()
+        record.extend(float(i) for i in fields)
+        if fixed and len(record) > width:
+            raise ValueError('{} fields in a record of {}: {}'.format(
+                len(record), width, line))
+        if not (fixed and continued and len(record) < width):
+            records.append(record)
+            record = []
+    if record:
+        records.append(record)
+    width = max([width] + [len(i) for i in records])
+    ret = np.zeros((len(records), width))
+    for i, record in enumerate(records):
+        ret[i, :len(record)] = record
+    return ret
+
+def _parse_labels(lines):
+    """parse data lines holding any number of comma separated labels"""
+    if not lines:
+        return np.zeros(0, dtype=np.int64)
+    text = _join_block(lines)[0]
+    split = _split_fields(text)
+    if split is not None:
+        return split[0].astype(np.int64)
+    # empty fields, such as blank lines, are left out
+    return np.array([int(i) for line in _block_lines(text)
+                     for i in line.split(',') if i.strip()],
+                    dtype=np.int64)
+
+class BulkHandler(KeywordHandler):
+    """collects the block and converts it in one shot on `end`
+
+    Chunks of a mapped file are also recorded as (offset, size) byte ranges
+    of the file, so that AbaqusParser.convert can send a large block to a
+    worker process.
+
+    """
+
+    def begin(self, kwargs):
+        self.part = self.model.part[self.parser.part]
+        self.lines = []
+        self.ranges = []
+        self.data = self.lines.append
+
+    def block(self, chunk):
+        self.lines.append(chunk)
+        self.ranges.append((self.parser.offset, len(chunk)))
+
+def _node_block(lines):
+    """(ids, positions) of the data lines of a *NODE block"""
+    records = _parse_records(lines)
+    # 2D nodes have no z coordinate; it is left at 0
+    pos = np.zeros((len(records), 3))
+    ncoord = min(records.shape[1] - 1, 3)
+    pos[:, :ncoord] = records[:, 1:ncoord + 1]
+    return records[:, 0].astype(np.int64), pos
+
+@register_keyword('NODE')
+class NodeHandler(BulkHandler):
+    def end(self):
+        self.parser.convert(self.part.add_nodes, _node_block, self.lines,
+                            self.ranges)
+        self.lines = []
+
+# nodes per element for the element types with a fixed node count; blocks of
+# other types take their width from the first data line
+ELEMENT_NODES = {
+    'B31': 2, 'T3D2': 2,
+    'S3': 3, 'S3R': 3, 'M3D3': 3,
+    'S4': 4, 'S4R': 4, 'M3D4': 4, 'M3D4R': 4,
+    'CPS4': 4, 'CPS4R': 4, 'CPE4': 4, 'CPE4R': 4, 'C3D4': 4,
+    'C3D6': 6, 'SC6R': 6, 'COH3D6': 6,
+    'C3D8': 8, 'C3D8R': 8, 'C3D8I': 8, 'SC8R': 8, 'COH3D8': 8,
+    'C3D10': 10, 'C3D10M': 10,
+    'C3D20': 20, 'C3D20R': 20,
+    }
+
+def _element_block(lines, type):
+    """(ids, connectivity) of the data lines of an *ELEMENT block"""
+    nnode = ELEMENT_NODES.get(type.upper())
+    records = _parse_records(lines, nnode and nnode + 1).astype(np.int64)
+    return records[:, 0], records[:, 1:]
+
+@register_keyword('ELEMENT')
+class ElementHandler(BulkHandler):
+    def begin(self, kwargs):
+        super().begin(kwargs)
+        self.type = kwargs['type']
+
+    def end(self):
+        self.parser.convert(
+            functools.partial(self.part.add_elements, self.type),
+            _element_block, self.lines, self.ranges, self.type)
+        self.lines = []
+
+class SetHandler(KeywordHandler):
+    """common handling of *NSET and *ELSET"""
+    set_type = None
+    name_parameter = None
+
+    def begin(self, kwargs):
+        s = Set()
+        s.name = kwargs[self.name_parameter]
+        if 'instance' in kwargs:
+            s.instance = kwargs['instance']
+            self.model.add_set(self.set_type, s)
+        else:
+            s.part = self.parser.part
+            self.model.part[s.part].set[self.set_type][s.name] = s
+        self.set = s
+        self.generate = 'generate' in kwargs
+        self.lines = []
+        self.data = self.lines.append
+        if not self.generate:
+            self.block = self.lines.append
+
+    def end(self):
+        if self.generate:
+            # one (start, stop[, increment]) range per line
+            for line in self.lines:
+                parts = [int(i) for i in line.split(',') if i.strip()]
+                if parts:
+                    self.set.add_range(*parts[:3])
+        else:
+            # explicit labels, any number per line
+            self.set.extend(_parse_labels(self.lines))
+        self.lines = []
+
+@register_keyword('NSET')
+class NsetHandler(SetHandler):
+    set_type = 'node'
+    name_parameter = 'nset'
+
+@register_keyword('ELSET')
+class ElsetHandler(SetHandler):
+    set_type = 'element'
+    name_parameter = 'elset'
+
+def _parse_keyword_line(line):
+    """split a keyword line into its upper case name and parameter dict
+
+    Parameter names are lower case; parameters without a value map to True.
+
+    """
+    splitline = line.split(',')
+    keyword = splitline.pop(0).strip(' *\r\n').upper()
+    kwargs = {}
+    for i in splitline:
+        i = i.strip()
+        if not i:
+            continue
+        if '=' in i:
+            name, value = i.split('=', 1)
+            kwargs[name.strip().lower()] = value.strip().strip('\'\"')
+        else:
+            kwargs[i.lower()] = True
+    return keyword, kwargs
+
+def ParseAbaqus(file, progress=None, cache=None, mapped=None, jobs=1,
+                index=None, select=None):
+    """parse an Abaqus keyword file in a single streaming pass
+
+    `file` is any iterable of text lines; it is never rewound, so pipes
+    and other non-seekable streams are accepted.  Progress is estimated
+    from the characters consumed against the size of the underlying file,
+    and reported as described in Progress.create.
+
+    Unless `mapped` is False, a file object opened on a regular file and
+    not yet read from is instead memory mapped and scanned as bytes: only
+    keyword lines are decoded (with the encoding of `file`), and the data
+    blocks of the bulk handlers go to the numeric parsers undecoded.
+    With `jobs` > 1 (0: one per CPU), large *NODE and *ELEMENT blocks of
+    a mapped file opened by name are then parsed in that many worker
+    processes, while the scan goes on.
+
+    A mapped file opened by name is parsed along its KeywordIndex if it has
+    a current one; with `index` True, the index is made if needed, and with
+    False it is not used.  A KeywordIndex may also be given.
+
+    With a Selection `select`, the model only holds what it selects.  The
+    blocks of unused parts and unselected sets of a mapped file are then
+    skipped without being parsed, using an index made in memory when the
+    file has none.  Such a model is not saved to `cache`.
+
+    With a ModelCache `cache`, a file opened by name is looked up in the
+    cache first, and its model saved there after parsing.
+
+    """
+    filename = _stream_path(file)
+    if cache is not None and filename is not None:
+        ret = cache.get(filename)
+        if ret is None:
+            ret = ParseAbaqus(file, progress, mapped=mapped, jobs=jobs,
+                              index=index, select=select)
+            if select is None:
+                cache.put(filename, ret)
+        elif select is not None:
+            select.apply(ret)
+        return ret
+
+    parser = AbaqusParser()
+    buf = None if mapped is False else _map_file(file)
+    if buf is None:
+        _parse_lines(parser, file, progress)
+    else:
+        parser.encoding = getattr(file, 'encoding', None) or 'utf-8'
+        parser.errors = getattr(file, 'errors', None) or 'strict'
+        if index in (None, True) and filename is not None:
+            index = KeywordIndex.for_file(filename, index is True, True,
+                                          parser.encoding, parser.errors)
+        if select is not None and index is None:
+            index = KeywordIndex.scan(buf, parser.encoding, parser.errors)
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+        if jobs > 1 and filename is not None:
+            parser.source = os.path.abspath(filename)
+            parser.pool = concurrent.futures.ProcessPoolExecutor(jobs)
+        try:
+            if isinstance(index, KeywordIndex):
+                skip = () if select is None else select.skipped(index)
+                _parse_indexed(parser, buf, index, progress, skip)
             else:
-                to_write = fmt + '\r'
-                sys.stdout.write(to_write)
-                sys.stdout.flush()
-
-    for line in file:
-        line_counter['current'] += 1
-        update_term()
-        current_instance = None
-        ret.count['line'] += 1
-        if regex['comment'].search(line):
+                _parse_mapped(parser, buf, progress)
+        finally:
+            try:
+                buf.close()
+            except BufferError:
+                # the frames of an exception being raised still hold slices
+                # of the map; it is unmapped when they are dropped, and the
+                # exception must not be hidden
+                pass
+            if parser.pool is not None:
+                _shutdown(parser.pool)
+    if select is not None:
+        select.apply(parser.model)
+    return parser.model
+
+def _shutdown(pool):
+    """shut a pool down, dropping the work not started (Python 3.9+)"""
+    if sys.version_info >= (3, 9):
+        pool.shutdown(cancel_futures=True)
+    else:
+        pool.shutdown()
+
+def _parse_lines(parser, file, progress):
+    ret = parser.model
+    progress = Progress.create(progress, 'Parsing', _stream_size(file),
+                               'lines')
+    nbytes = 0
+    nlines = 0
+
+    handler = KeywordHandler(parser, None)
+    data = handler.data
+    for nlines, line in enumerate(file, 1):
+        nbytes += len(line)
+        if not nlines & 0x3fff:
+            progress.update(nlines, nbytes)
+        if line[:1] != '*':
+            data(line)
+            continue
+        if line[:2] == '**':
             # This is a comment line
             ret.count['comment'] += 1
             continue
-        if regex['keyword'].search(line):
-            match = regex['keyword'].search(line)
-            # This is a keyword line
+        # This is a keyword line; close the previous block and dispatch
+        handler.end()
+        kw, kwargs = _parse_keyword_line(line)
+        ret.count['keyword'] += 1
+        ret.count['*' + kw] += 1
+        handler = get_keyword_handler(kw)(parser, kw)
+        handler.begin(kwargs)
+        data = handler.data
+    handler.end()
+    ret.count['line'] = nlines
+
+    progress.update(nlines, nbytes)
+    progress.finish()
+
+def _map_file(file):
+    """read-only mmap of the regular file behind an unread stream, or None"""
+    if not _plain_file(file):
+        return None
+    try:
+        fd = file.fileno()
+        info = os.fstat(fd)
+        if file.tell() != 0 or not stat.S_ISREG(info.st_mode) or \
+                info.st_size == 0:
+            return None
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        return None
+
+def _count_lines(buf, start=0, stop=None, block=1 << 24):
+    """number of lines of buf[start:stop], counted `block` bytes at a time"""
+    if stop is None:
+        stop = len(buf)
+    ret = 0
+    for i in range(start, stop, block):
+        ret += buf[i:min(i + block, stop)].count(b'\n')
+    return ret + (stop > start and buf[stop - 1:stop] != b'\n')
+
+def _data_end(buf, pos, stop):
+    """end of the data lines from `pos`: the start of the next line of
+    buf[:stop] starting with '*', or `stop`
+
+    Numeric data holds no '*', so searching for it alone is much faster
+    than searching for '\\n*'.
+
+    """
+    find = buf.find
+    while True:
+        i = find(b'*', pos, stop)
+        if i < 0:
+            return stop
+        if buf[i - 1] == 0x0a:  # '\n'
+            return i
+        pos = i + 1
+
+def _parse_mapped(parser, buf, progress):
+    """parse a memory mapped file
+
+    Data runs up to the next line starting with '*' are found by _data_end
+    and handed to the handler's `block` as memoryview slices, so
+    data lines cost no Python work of their own.
+
+    """
+    ret = parser.model
+    size = len(buf)
+    progress = Progress.create(progress, 'Parsing', size, 'keywords')
+    view = memoryview(buf)
+    find = buf.find
+
+    handler = KeywordHandler(parser, None)
+    block = handler.block
+    pos = 0
+    try:
+        while pos < size:
+            if buf[pos] != 0x2a:    # '*'
+                stop = _data_end(buf, pos, size)
+                parser.offset = pos
+                block(view[pos:stop])
+                pos = stop
+                continue
+            stop = find(b'\n', pos)
+            stop = size if stop < 0 else stop + 1
+            if buf[pos + 1:pos + 2] == b'*':
+                # This is a comment line
+                ret.count['comment'] += 1
+                pos = stop
+                continue
+            # This is a keyword line; close the previous block and dispatch
+            handler.end()
+            line = buf[pos:stop].decode(parser.encoding, parser.errors)
+            pos = stop
+            kw, kwargs = _parse_keyword_line(line)
             ret.count['keyword'] += 1
-            kw = match.group(0).upper().strip(' ,\n*')
             ret.count['*' + kw] += 1
-            count['keyword_line'] = 0
-            # parse keyword arguments
-            kwargs = {}
-            splitline = line.split(',')
-            splitline.pop(0)
-            for i in splitline:
-                i = i.strip(' \n')
-                if '=' in i:
-                    i = i.split('=')
-                    kwargs[i[0]] = i[1].strip('\'\"')
-                else:
-                    kwargs[i] = True
-            #print('{:5d}:{:15s}'.format(ret.count['line'],kw))
-            #if len(kwargs) > 0:
-                #print(kwargs)
-
-
-        if regex['data'].search(line):
-            count['keyword_line'] += 1
-
-        # from here on, process the current keyword
-
-        if kw == 'PART':
-            if count['keyword_line'] == 0:
-                name = kwargs['name']
-                ret.part[name] = AbaqusPart(name)
-                current_part = name
-        if kw == 'END PART':
-            current_part = None
-        if kw == 'ASSEMBLY':
-            in_assembly = True
-        if kw == 'END ASSEMBLY':
-            in_assembly = False
-        if kw == 'INSTANCE':
-            if count['keyword_line'] == 0:
-                instance = AbaqusInstance()
-                instance.name = kwargs['name']
-                instance.part = kwargs['part']
-                current_instance = instance.name
-                ret.instance[instance.name] = instance
-            if count['keyword_line'] == 1:
-                parts = line.split(',')
-                instance.translation[:] = parts
-            if count['keyword_line'] == 2:
-                parts = line.split(',')
-                instance.rotation['a'][:] = parts[0:3]
-                instance.rotation['b'][:] = parts[3:6]
-                instance.rotation['deg'] = float(parts[6])
-        if kw == 'END INSTANCE':
-            current_instance = None
-        if kw == 'ORIENTATION':
-            if count['keyword_line'] == 0:
-                orient = Orientation()
-                orient.name = kwargs['name']
-                if 'system' in kwargs:
-                    orient.system = kwargs['system']
-                else:
-                    orient.system = 'RECTANGULAR'
-                ret.part[current_part].orientation[orient.name] = orient
-            elif count['keyword_line'] == 1:
-                parts = line.split(',')
-                orient.a[:] = parts[0:3]
-                orient.b[:] = parts[3:6]
-                if len(parts) == 9:
-                    orient.c[:] = parts[6:9]
-            elif count['keyword_line'] == 2:
-                parts = line.split(',')
-                orient.rot_axis = int(parts[0])
-                orient.rot = float(parts[1])
-        if 'SECTION' in kw:
-            if count['keyword_line'] == 0 and 'orientation' in kwargs:
-                section = Section()
-                section.elset = kwargs['elset']
-                section.orientation = kwargs['orientation']
-                ret.part[current_part].section.append(section)
-        if kw == 'NODE':
-            #import pdb; pdb.set_trace()
-            if count['keyword_line'] > 0:
-                parts = line.split(',')
-                node = Node()
-                node.id = int(parts[0])
-                node.pos[0] = float(parts[1])
-                node.pos[1] = float(parts[2])
-                try:
-                    node.pos[2] = float(parts[3])
-                except:
-                    pass
-                ret.part[current_part].node[node.id] = node
-        if kw == 'ELEMENT':
-            if count['keyword_line'] > 0:
-                parts = line.split(',')
-                element = Element()
-                element.id = int(parts[0])
-                for i in range(1,len(parts)):
-                    element.node.append(int(parts[i]))
-                element.type = kwargs['type']
-                ret.part[current_part].element[element.id] = element
-        if kw == 'ELSET':
-            if count['keyword_line'] == 0:
-                elset = Set()
-                elset.name = kwargs['elset']
-                if 'instance' in kwargs:
-                    elset.instance = kwargs['instance']
-                    ret.set['element'][elset.name] = elset
-                else:
-                    elset.part = current_part
-                    ret.part[current_part].set['element'][elset.name] = elset
-
-            if count['keyword_line'] > 0:
-                parts = line.split(',')
-                try:
-                    if kwargs['generate']:
-                        start = int(parts[0])
-                        stop = int(parts[1]) + 1
-                        inc = int(parts[2])
-                        for i in range(start, stop, inc):
-                            elset.append(i)
-                except:
-                    for i in parts:
-                        elset.append(int(i))
-        if kw == 'NSET':
-            if count['keyword_line'] == 0:
-                nset = Set()
-                nset.name = kwargs['nset']
-                if 'instance' in kwargs:
-                    nset.instance = kwargs['instance']
-                    ret.set['node'][nset.name] = nset
-                else:
-                    nset.part = current_part
-                    ret.part[current_part].set['node'][nset.name] = nset
-
-            if count['keyword_line'] > 0:
-                parts = line.split(',')
+            handler = get_keyword_handler(kw)(parser, kw)
+            handler.begin(kwargs)
+            block = handler.block
+            progress.update(ret.count['keyword'], pos)
+        handler.end()
+    finally:
+        # drop the slices still held, so that the map can be closed
+        handler = block = None
+        view.release()
+    ret.count['line'] = _count_lines(buf)
+    parser.finish()
+
+    progress.update(ret.count['keyword'], size)
+    progress.finish()
+
+def _parse_indexed(parser, buf, index, progress, skip=()):
+    """parse a memory mapped file along its KeywordIndex
+
+    The keyword lines are not searched for: each entry's handler is given
+    the data between its keyword line and the next one, with comment lines
+    left out.  The blocks of the entries at the positions in `skip` are
+    only counted.
+
+    """
+    ret = parser.model
+    size = len(buf)
+    progress = Progress.create(progress, 'Parsing', size, 'keywords')
+    view = memoryview(buf)
+    find = buf.find
+
+    handler = None
+    try:
+        for k, entry in enumerate(index.entries):
+            kw = entry.keyword
+            ret.count['keyword'] += 1
+            ret.count['*' + kw] += 1
+            if k in skip:
+                continue
+            handler = get_keyword_handler(kw)(parser, kw)
+            handler.begin(dict(entry.params))
+            block = handler.block
+            pos = entry.data
+            while pos < entry.end:
+                if buf[pos] == 0x2a:    # a comment line
+                    stop = find(b'\n', pos, entry.end)
+                    pos = entry.end if stop < 0 else stop + 1
+                    continue
+                stop = _data_end(buf, pos, entry.end)
+                parser.offset = pos
+                block(view[pos:stop])
+                pos = stop
+            handler.end()
+            progress.update(ret.count['keyword'], entry.end)
+    finally:
+        handler = block = None
+        view.release()
+    ret.count['comment'] = index.comments
+    ret.count['line'] = index.lines
+    parser.finish()
+
+    progress.update(ret.count['keyword'], size)
+    progress.finish()
+
+def keyword_index_path(filename):
+    """path of the KeywordIndex sidecar file of an input file"""
+    return filename + '.kwindex'
+
+IndexEntry = collections.namedtuple(
+    'IndexEntry', ['offset', 'data', 'end', 'keyword', 'params', 'lines'])
+IndexEntry.__doc__ = """a keyword line of a KeywordIndex
+
+`offset` is the position of the keyword line in the file, and the data of
+its block, comment lines included, runs from `data` to `end`.  `keyword`
+and `params` are as returned by _parse_keyword_line, and `lines` is the
+number of data lines of the block.
+
+"""
+
+class KeywordIndex():
+    """the keyword lines of an input file, with their byte offsets
+
+    Made by a single scan of the file as bytes, and saved as a JSON sidecar
+    file next to it (see keyword_index_path), which is used for as long as
+    the size and modification time of the file are unchanged.  ParseAbaqus
+    takes the blocks straight from the index, and `stats` gives the keyword
+    and line counts of the model without parsing it.
+
+    """
+    VERSION = 1
+
+    def __init__(self):
+        self.size = 0
+        self.mtime_ns = 0
+        self.lines = 0
+        self.comments = 0
+        self.entries = []
+
+    @classmethod
+    def scan(cls, buf, encoding='utf-8', errors='strict'):
+        """index the bytes-like `buf`, a memory mapped file say"""
+        ret = cls()
+        size = len(buf)
+        find = buf.find
+        entries = []
+        entry = None
+        lines = 0
+        pos = 0
+        while pos < size:
+            if buf[pos] != 0x2a:    # '*'
+                stop = _data_end(buf, pos, size)
+                n = _count_lines(buf, pos, stop)
+                lines += n
+                if entry is not None:
+                    entry[5] += n
+                pos = stop
+                continue
+            stop = find(b'\n', pos)
+            stop = size if stop < 0 else stop + 1
+            if buf[pos + 1:pos + 2] == b'*':
+                ret.comments += 1
+                pos = stop
+                continue
+            if entry is not None:
+                entry[2] = pos
+            kw, kwargs = _parse_keyword_line(
+                buf[pos:stop].decode(encoding, errors))
+            entry = [pos, stop, size, kw, kwargs, 0]
+            entries.append(entry)
+            pos = stop
+        ret.size = size
+        ret.lines = lines + ret.comments + len(entries)
+        ret.entries = [IndexEntry(*i) for i in entries]
+        return ret
+
+    @classmethod
+    def load(cls, filename):
+        """the sidecar index of `filename`, None if missing or out of date"""
+        try:
+            info = os.stat(filename)
+            with open(keyword_index_path(filename)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != cls.VERSION or \
+                data.get('size') != info.st_size or \
+                data.get('mtime_ns') != info.st_mtime_ns:
+            return None
+        ret = cls()
+        ret.size = data['size']
+        ret.mtime_ns = data['mtime_ns']
+        ret.lines = data['lines']
+        ret.comments = data['comments']
+        ret.entries = [IndexEntry(*i) for i in data['entries']]
+        return ret
+
+    def save(self, filename):
+        """write the sidecar index of `filename`; False if it cannot be"""
+        data = {
+            'version': self.VERSION,
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+            'lines': self.lines,
+            'comments': self.comments,
+            'entries': self.entries,
+            }
+        try:
+            with open(keyword_index_path(filename), 'w') as f:
+                json.dump(data, f)
+        except OSError:
+            return False
+        return True
+
+    @classmethod
+    def for_file(cls, filename, build=True, save=True, encoding='utf-8',
+                 errors='strict'):
+        """the current index of `filename`, or None
+
+        When there is none and `build`, the file is scanned, and the index
+        saved if `save`.
+
+        """
+        ret = cls.load(filename)
+        if ret is not None or not build:
+            return ret
+        with open(filename, 'rb') as f:
+            info = os.fstat(f.fileno())
+            if info.st_size == 0:
+                ret = cls()
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    ret = cls.scan(buf, encoding, errors)
+        ret.mtime_ns = info.st_mtime_ns
+        if save:
+            ret.save(filename)
+        return ret
+
+    def stats(self):
+        """(count, data lines) Counters of the model
+
+        `count` is that of the AbaqusInput parsed from the file; `data
+        lines` counts the data lines of the blocks of each '*KEYWORD'.
+
+        """
+        count = collections.Counter()
+        lines = collections.Counter()
+        for entry in self.entries:
+            count['*' + entry.keyword] += 1
+            lines['*' + entry.keyword] += entry.lines
+        count['keyword'] = len(self.entries)
+        count['comment'] = self.comments
+        count['line'] = self.lines
+        return count, lines
+
+def write_keyword_stats(index, stream):
+    """write a table of the keyword and line counts of a KeywordIndex"""
+    count, lines = index.stats()
+    stream.write('{:>12d} lines\n'.format(count['line']))
+    stream.write('{:>12d} comment lines\n'.format(count['comment']))
+    stream.write('{:>12d} keyword lines\n'.format(count['keyword']))
+    stream.write('{:>12s}{:>12s}  {}\n'.format('count', 'data lines',
+                                               'keyword'))
+    for key in count:
+        if key.startswith('*'):
+            stream.write('{:12d}{:12d}  {}\n'.format(count[key], lines[key],
+                                                    key))
+
+class Selection():
+    """the instances and assembly sets of a model to convert
+
+    `instances`, `parts` and `sets` are lists of names, which may be
+    fnmatch patterns, or None.  An instance is selected when its name is in
+    `instances` or its part in `parts`; when both are None, every instance
+    is.  The parts of the selected instances are kept, with the assembly
+    sets of those instances named in `sets` (all when None).  Assembly sets
+    are matched by their full name or by the name after its '#<id>:'.
+
+    """
+
+    def __init__(self, instances=None, parts=None, sets=None):
+        self.instances = instances
+        self.parts = parts
+        self.sets = sets
+
+    @staticmethod
+    def _match(name, patterns):
+        return any(fnmatch.fnmatchcase(name, i) for i in patterns)
+
+    def instance(self, name, part):
+        """whether the instance `name` of `part` is selected"""
+        if self.instances is None and self.parts is None:
+            return True
+        return (self.instances is not None and
+                self._match(name, self.instances) or
+                self.parts is not None and self._match(part, self.parts))
+
+    def set(self, name):
+        """whether an assembly set of a selected instance is selected"""
+        if self.sets is None:
+            return True
+        return self._match(name, self.sets) or \
+            self._match(name.split(':', 1)[-1], self.sets)
+
+    def skipped(self, index):
+        """positions in the entries of a KeywordIndex of the blocks that
+        need not be parsed: those of unused parts and unselected sets
+
+        The *PART and *END PART lines of unused parts are still parsed,
+        so that assembly level sets that follow are not taken for sets of
+        the part before.
+
+        """
+        instances = set()
+        parts = set()
+        for entry in index.entries:
+            if entry.keyword == 'INSTANCE' and self.instance(
+                    entry.params.get('name'), entry.params.get('part')):
+                instances.add(entry.params.get('name'))
+                parts.add(entry.params.get('part'))
+        ret = set()
+        in_part = False
+        for k, entry in enumerate(index.entries):
+            params = entry.params
+            if entry.keyword == 'PART':
+                in_part = params.get('name') not in parts
+            elif entry.keyword == 'END PART':
+                in_part = False
+            elif in_part:
+                ret.add(k)
+            elif entry.keyword in ('NSET', 'ELSET') and 'instance' in params:
+                name = params.get(entry.keyword.lower())
+                if params['instance'] not in instances or \
+                        not isinstance(name, str) or not self.set(name):
+                    ret.add(k)
+        return ret
+
+    def apply(self, inp):
+        """remove what is not selected from a parsed model; returns it
+
+        Raises ValueError when one of `instances` or `parts` matches no
+        instance of the model.
+
+        """
+        for patterns, names in (
+                (self.instances, list(inp.instance)),
+                (self.parts, [i.part for i in inp.instance.values()])):
+            for pattern in patterns or ():
+                if not any(fnmatch.fnmatchcase(i, pattern) for i in names):
+                    raise ValueError('no instance matches {!r}'.format(pattern))
+        for name, instance in list(inp.instance.items()):
+            if not self.instance(name, instance.part):
+                del inp.instance[name]
+        used = {i.part for i in inp.instance.values()}
+        for name in list(inp.part):
+            if name not in used:
+                del inp.part[name]
+        for type in ('node', 'element'):
+            for name, s in list(inp.set[type].items()):
+                if s.instance not in inp.instance or not self.set(name):
+                    del inp.set[type][name]
+                    del inp.set_by_instance[type][s.instance][name]
+        return inp
+
+# parsed model cache
+#
+# A parsed model is saved as a single uncompressed .npz file: the columns of
+# each part and the explicit segments of each set as arrays, everything else
+# (names, instances, orientations, sections, counts) as a JSON document in
+# the 'meta' array.  No pickles are involved.
+
+CACHE_VERSION = 1
+
+def _set_meta(s, arrays, prefix):
+    segments = []
+    for k, segment in enumerate(s.segments):
+        if isinstance(segment, range):
+            segments.append([segment.start, segment.stop, segment.step])
+        else:
+            key = '{}/{}'.format(prefix, k)
+            arrays[key] = segment
+            segments.append(key)
+    return {'name': s.name, 'instance': s.instance, 'part': s.part,
+            'segments': segments}
+
+def _meta_set(meta, arrays):
+    s = Set()
+    s.name = meta['name']
+    s.instance = meta['instance']
+    s.part = meta['part']
+    s.segments = [arrays[i] if isinstance(i, str) else range(*i)
+                  for i in meta['segments']]
+    return s
+
+def save_model(inp, file):
+    """save a parsed model to `file` (a path or binary file) as .npz"""
+    arrays = {}
+    parts = []
+    for i, part in enumerate(inp.part.values()):
+        prefix = 'part{}/'.format(i)
+        for name in ('node_id', 'node_pos', 'element_id', 'element_node',
+                     'element_type'):
+            arrays[prefix + name] = getattr(part, name)
+        parts.append({
+            'name': part.name,
+            'element_types': part.element_types,
+            'element_type_nodes': part.element_type_nodes,
+            'set': {type: [_set_meta(s, arrays, '{}{}{}'.format(prefix, type, j))
+                           for j, s in enumerate(part.set[type].values())]
+                    for type in ('node', 'element')},
+            'section': [[i.elset, i.orientation] for i in part.section],
+            'orientation': [{
+                'name': i.name, 'system': i.system,
+                'a': i.a.tolist(), 'b': i.b.tolist(), 'c': i.c.tolist(),
+                'rot_axis': i.rot_axis, 'rot': i.rot,
+                } for i in part.orientation.values()],
+            })
+    meta = {
+        'version': CACHE_VERSION,
+        'part': parts,
+        'instance': [{
+            'name': i.name, 'part': i.part,
+            'translation': i.translation.tolist(),
+            'a': i.rotation['a'].tolist(), 'b': i.rotation['b'].tolist(),
+            'deg': float(i.rotation['deg']),
+            } for i in inp.instance.values()],
+        'set': {type: [_set_meta(s, arrays, 'set/{}{}'.format(type, j))
+                       for j, s in enumerate(inp.set[type].values())]
+                for type in ('node', 'element')},
+        'count': dict(inp.count),
+        }
+    arrays['meta'] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    np.savez(file, **arrays)
+
+def load_model(file):
+    """load a model saved by save_model; ValueError if it is not one"""
+    with np.load(file, allow_pickle=False) as data:
+        arrays = {i: data[i] for i in data.files}
+    meta = json.loads(arrays.pop('meta').tobytes().decode())
+    if meta.get('version') != CACHE_VERSION:
+        raise ValueError('unsupported model cache version')
+    ret = AbaqusInput()
+    for i, p in enumerate(meta['part']):
+        prefix = 'part{}/'.format(i)
+        part = AbaqusPart(p['name'])
+        part.element_types = p['element_types']
+        part.element_type_nodes = p['element_type_nodes']
+        for name in part._columns:
+            part._columns[name] = arrays[prefix + name]
+        for type in ('node', 'element'):
+            for s in p['set'][type]:
+                part.set[type][s['name']] = _meta_set(s, arrays)
+        for elset, orientation in p['section']:
+            section = Section()
+            section.elset = elset
+            section.orientation = orientation
+            part.section.append(section)
+        for o in p['orientation']:
+            orient = Orientation()
+            orient.name = o['name']
+            orient.system = o['system']
+            orient.a[:] = o['a']
+            orient.b[:] = o['b']
+            orient.c[:] = o['c']
+            orient.rot_axis = o['rot_axis']
+            orient.rot = o['rot']
+            part.orientation[orient.name] = orient
+        ret.part[part.name] = part
+    for i in meta['instance']:
+        instance = AbaqusInstance()
+        instance.name = i['name']
+        instance.part = i['part']
+        instance.translation[:] = i['translation']
+        instance.rotation['a'][:] = i['a']
+        instance.rotation['b'][:] = i['b']
+        instance.rotation['deg'] = i['deg']
+        ret.instance[instance.name] = instance
+    for type in ('node', 'element'):
+        for s in meta['set'][type]:
+            ret.add_set(type, _meta_set(s, arrays))
+    ret.count.update(meta['count'])
+    return ret
+
+def default_cache_dir():
+    """$ABAQUS2DYNA_CACHE, or abaqus2dyna in the user cache directory"""
+    if os.environ.get('ABAQUS2DYNA_CACHE'):
+        return os.environ['ABAQUS2DYNA_CACHE']
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'abaqus2dyna')
+
+class ModelCache():
+    """persistent cache of parsed models, one .npz file per input content
+
+    Entries are named by a hash of the input file, so a copied or renamed
+    input still hits.  The hash of each input is remembered in
+    `index.json` along with the file's size and modification time, and
+    only computed again when either changes.  The cache is kept below
+    `max_size` bytes by removing the least recently used entries; using an
+    entry refreshes its modification time.
+
+    Entries hold what the registered keyword handlers produced when they
+    were written; clear the cache after changing the handlers.
+
+    """
+
+    def __init__(self, directory=None, max_size=4 << 30):
+        self.directory = default_cache_dir() if directory is None else directory
+        self.max_size = max_size
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_index(self):
+        try:
+            with open(self._path('index.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _replace(self, name, write, mode='wb'):
+        """write a cache file atomically with write(file)"""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp, self._path(name))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def key(self, filename):
+        """hash of the content of `filename`, from the index when current"""
+        path = os.path.realpath(filename)
+        info = os.stat(path)
+        index = self._read_index()
+        entry = index.get(path)
+        if entry and entry[:2] == [info.st_size, info.st_mtime_ns]:
+            return entry[2]
+        h = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as f:
+            for block in iter(functools.partial(f.read, 1 << 20), b''):
+                h.update(block)
+        key = '{}-{}'.format(h.hexdigest(), CACHE_VERSION)
+        index[path] = [info.st_size, info.st_mtime_ns, key]
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._replace('index.json', lambda f: json.dump(index, f), 'w')
+        except OSError:
+            pass    # the hash is computed again next time
+        return key
+
+    def get(self, filename):
+        """the cached model of `filename`, or None"""
+        path = self._path(self.key(filename) + '.npz')
+        try:
+            ret = load_model(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return ret
+
+    def put(self, filename, inp):
+        """save the model parsed from `filename`, then evict old entries
+
+        A cache that cannot be written to is silently left as it is.
+
+        """
+        key = self.key(filename)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._replace(key + '.npz', functools.partial(save_model, inp))
+        except OSError:
+            return
+        self.evict()
+
+    def entries(self):
+        """(mtime, size, path) of each entry, least recently used first"""
+        ret = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return ret
+        for name in names:
+            if name.endswith('.npz'):
                 try:
-                    if kwargs['generate']:
-                        start = int(parts[0])
-                        stop = int(parts[1]) + 1
-                        inc = int(parts[2])
-                        for i in range(start, stop, inc):
-                            nset.append(i)
-                except:
-                    for i in parts:
-                        nset.append(int(i))
-
-    update_term(True)
-    #import pdb; pdb.set_trace()
+                    info = os.stat(self._path(name))
+                except OSError:
+                    continue
+                ret.append((info.st_mtime, info.st_size, self._path(name)))
+        return sorted(ret)
+
+    def evict(self):
+        """remove least recently used entries until within `max_size`"""
+        entries = self.entries()
+        size = sum(i[1] for i in entries)
+        for mtime, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            size -= entry_size
+
+    def clear(self):
+        """remove all entries and the index"""
+        for entry in self.entries():
+            try:
+                os.unlink(entry[2])
+            except OSError:
+                pass
+        try:
+            os.unlink(self._path('index.json'))
+        except OSError:
+            pass
+
+# fixed width LS-DYNA cards, as %-formats of one row of write_cards columns
+NODE_CARD = '%8d' + '%16.8e' * 3 + '\n'
+ELEMENT_CARD = '%8d' * 10 + '\n'
+ORTHO_CARD = ELEMENT_CARD + ('%16.7e' * 3 + '\n') * 2
+
+def write_cards(stream, fmt, columns, block=16384):
+    """write one card per row of `columns` with the %-format `fmt`
+
+    `columns` are 1D or 2D arrays with one row per card, concatenated left
+    to right to fill the fields of `fmt`.  Rows are formatted `block` at a
+    time by a single %-operation and written with a single write.  Integer
+    fields are passed as floats, exact for labels below 2**53.
+
+    """
+    columns = [np.asarray(i) for i in columns]
+    columns = [i.reshape(len(i), -1) for i in columns]
+    rows = len(columns[0])
+    width = sum(i.shape[1] for i in columns)
+    table = np.empty((min(rows, block), width))
+    for start in range(0, rows, block):
+        stop = min(start + block, rows)
+        n = stop - start
+        col = 0
+        for i in columns:
+            table[:n, col:col + i.shape[1]] = i[start:stop]
+            col += i.shape[1]
+        stream.write((fmt * n) % tuple(table[:n].ravel().tolist()))
+
+def _normalize(v):
+    """rows of `v` scaled to unit length"""
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+def orthotropic_axes(orient, centroids, instance):
+    """a and d direction vectors of *ELEMENT_SOLID_ORTHO cards
+
+    Computes the local axes of `orient` for all elements with the (n,3)
+    `centroids` at once, including the optional rotation about local axis
+    `rot_axis`, and rotates them with the instance.  Returns two (n,3)
+    arrays of unit vectors.
+
+    """
+    centroids = np.asarray(centroids, dtype=float).reshape(-1, 3)
+    n = len(centroids)
+    system = orient.system
+    if system == 'CYLINDRICAL':
+        c = _normalize(orient.b - orient.a)
+        g = centroids - orient.a # to centroids from a
+        h = g.dot(c) # distance along _ab_ to centroids
+        h = orient.a + h[:, None]*c # points on _ab_ nearest the centroids
+        a = _normalize(centroids - h)
+        d = np.cross(c, a)
+        c = np.broadcast_to(c, a.shape)
+    elif system in ['RECTANGULAR', None]:
+        a = _normalize(orient.a)
+        b = _normalize(orient.b)
+        c = np.cross(a, b)
+        d = np.cross(c, a)
+        a, c, d = (np.broadcast_to(i, (n, 3)) for i in (a, c, d))
+    else:
+        raise Exception('yep, ' + system + ' not yet implemented')
+    # maybe an additional rotation?
+    if orient.rot:
+        if orient.rot_axis == 1:
+            axis_point = a
+        elif orient.rot_axis == 2:
+            axis_point = d
+        else:
+            axis_point = c
+        rotation_matrix = GetRotationMatrices(axis_point, orient.rot)
+        a = np.einsum('nij,nj->ni', rotation_matrix, a)
+        d = np.einsum('nij,nj->ni', rotation_matrix, d)
+    # rotate local CS with instance
+    rotation_matrix = instance.rotation_matrix
+    a = a @ rotation_matrix.T
+    d = d @ rotation_matrix.T
+    return _normalize(a), _normalize(d)
+
+def _set_label(name):
+    """(id, name) of an assembly set named '#<id>:<name>'"""
+    set_naming_parts = name.split(':')
+    return int(set_naming_parts[0][1:]), set_naming_parts[1]
+
+def _model_stats(inp):
+    """ids and names of the parts and sets the writer will emit, in order"""
+    stats = {}
+    stats['pid'] = []
+    stats['esid'] = []
+    stats['nsid'] = []
+    for pid, i in enumerate(inp.instance, 1):
+        stats['pid'].append([pid, i])
+        for k, s in inp.instance_sets('element', i):
+            stats['esid'].append(list(_set_label(k)))
+        for k, s in inp.instance_sets('node', i):
+            stats['nsid'].append(list(_set_label(k)))
+    return stats
+
+ELEMENT_CONVERSION = {'C3D8R':'SOLID',
+                      'S4R':'SHELL'}
+
+def comment_line(string, fill='', newline=True):
+    ret = ('${:' + fill + '^78s}$').format(string)
+    if newline:
+        ret += '\n'
+    return ret
+
+def instance_layout(inp):
+    """(name, pid, node offset, element offset) of each instance, in order
+
+    Nodes and elements of each instance are numbered after those of all
+    the instances before it, so the offsets follow from the part sizes.
+
+    """
+    ret = []
+    offset = collections.Counter()
+    for pid, i in enumerate(inp.instance, 1):
+        part = inp.part[inp.instance[i].part]
+        ret.append((i, pid, offset['node'], offset['element']))
+        offset['node'] += len(part.node)
+        offset['element'] += len(part.element)
     return ret
 
-def WriteDynaFromAbaqus(total_nodel, inp_name, abaqus_keyword, ostream):
-    #global total_nodel
-    written_nodel = 0
-    def update_term(complete=False):
-        #global total_nodel
-        #global ostream
-        total = total_nodel
-        counted = count['node'] + count['element']
-        perc = int(1000 * counted * 1.0 / total)
-        old_perc = int(1000 * (counted-1)*1.0/total)
-        if perc != old_perc or counted == 1:
-            status = 'Compiling data ({:5.1f}% complete)'.format(perc/10)
-            if complete:
-                to_write = status + '...done\n'
+def _instance_cards(inp, name, pid, node_offset, element_offset,
+                    generate_sets=False):
+    """output of one instance, as a sequence of text and card blocks
+
+    Card blocks are (fmt, columns) arguments for write_cards.
+
+    """
+    yield comment_line('',fill='*')
+    yield comment_line('Data for part ' + name + ', pid=' + str(pid))
+    yield comment_line('',fill='*')
+    instance = inp.instance[name]
+    part = inp.part[instance.part]
+    yield from _part_cards(part, instance, pid, node_offset, element_offset)
+    yield from _set_cards(inp, instance, part, node_offset, element_offset,
+                          generate_sets)
+
+def _part_cards(part, instance, pid, node_offset, element_offset):
+    """*NODE and *ELEMENT cards of a part placed as `instance`"""
+    offset = {'node': node_offset, 'element': element_offset}
+    element_conversion = ELEMENT_CONVERSION
+    # write nodes
+    if part.node:
+        yield '*NODE\n'
+        ids = part.node_id + offset['node']
+        positions = instance.transform(part.node_pos)
+        yield NODE_CARD, [ids, positions]
+    if part.element:
+        kind = [element_conversion[t] for t in part.element_types]
+        codes = part.element_type
+        solid = np.array([k == 'SOLID' for k in kind])[codes]
+        has_orient = solid & (part.element_section >= 0)
+        ids = part.element_id + offset['element']
+        # connectivity padded (or cut) to 8 nodes; only nodes, not the
+        # padding, are offset
+        nodes = np.zeros((len(ids), 8), dtype=np.int64)
+        width = min(part.element_node.shape[1], 8)
+        nodes[:, :width] = part.element_node[:, :width]
+        nnode = np.array(part.element_type_nodes)[codes]
+        nodes[np.arange(8) < nnode[:, None]] += offset['node']
+        # a new *ELEMENT card starts wherever the type or the presence
+        # of an orientation changes
+        key = codes * 2 + has_orient
+        runs = np.concatenate(
+            [[0], np.flatnonzero(np.diff(key)) + 1, [len(ids)]])
+        for start, stop in zip(runs[:-1], runs[1:]):
+            this_has_orient = has_orient[start]
+            yield '*ELEMENT_' + kind[codes[start]]
+            if this_has_orient:
+                yield '_ORTHO'
+            yield '\n'
+            columns = [ids[start:stop], np.full(stop - start, pid),
+                       nodes[start:stop]]
+            fmt = ELEMENT_CARD
+            if this_has_orient:
+                columns.extend(part.element_axes(instance, start, stop))
+                fmt = ORTHO_CARD
+            yield fmt, columns
+
+SET_CARD = '%10d' * 8 + '\n'
+
+def _set_member_cards(set_id, keyword, members, generate=False):
+    """*SET card of `members` (already offset), 8 labels per line
+
+    With `generate`, the set is written as a *SET_..._GENERATE card of
+    (first, last) ranges of consecutive labels instead, if that takes
+    fewer lines.
+
+    """
+    if not len(members):
+        return ['\n']
+    if generate:
+        # runs of consecutive labels
+        breaks = np.flatnonzero(np.diff(members) != 1) + 1
+        runs = len(breaks) + 1
+        # lines of 4 ranges against lines of 8 labels
+        if (runs + 3) // 4 < (len(members) + 7) // 8:
+            first = members[np.concatenate([[0], breaks])]
+            last = members[np.concatenate([breaks - 1, [len(members) - 1]])]
+            ranges = np.column_stack([first, last]).ravel()
+            return _set_member_cards(set_id, keyword + '_GENERATE', ranges)
+    full = len(members) - len(members) % 8
+    ret = ['{}\n{:10d}\n'.format(keyword, set_id)]
+    if full:
+        ret.append((SET_CARD, [members[:full].reshape(-1, 8)]))
+    if full < len(members):
+        rest = members[full:].tolist()
+        ret.append('%10d' * len(rest) % tuple(rest) + '\n')
+    return ret
+
+def _set_cards(inp, instance, part, node_offset, element_offset,
+               generate=False):
+    """*SET cards of the assembly sets of an instance
+
+    `generate` writes sets as ranges where that is shorter; see
+    _set_member_cards.
+
+    """
+    offset = {'node': node_offset, 'element': element_offset}
+    element_conversion = ELEMENT_CONVERSION
+    for k, elset in inp.instance_sets('element', instance.name):
+        #TODO, need to check that all elements are same type (for DYNA sake)
+        set_id, set_name = _set_label(k)
+        members = elset.to_array()
+        keyword = None
+        if len(members):
+            element = part.element[int(members[0])]
+            keyword = '*SET_' + element_conversion[element.type]
+        yield from _set_member_cards(set_id, keyword,
+                                     members + offset['element'], generate)
+    for k, nset in inp.instance_sets('node', instance.name):
+        set_id, set_name = _set_label(k)
+        yield from _set_member_cards(set_id, '*SET_NODE',
+                                     nset.to_array() + offset['node'],
+                                     generate)
+
+def _include_cards(inp, name, pid, node_offset, element_offset, filename,
+                   generate_sets=False):
+    """output of one instance placed by *INCLUDE_TRANSFORM of a part file
+
+    The part file holds the part's nodes and elements, numbered from 1
+    with pid 1; the include offsets them like the instance's own cards.
+    The instance rotation and translation go into a *DEFINE_TRANSFORMATION
+    with id `pid`.  Cards are written in free (comma separated) format to
+    keep full precision.
+
+    """
+    instance = inp.instance[name]
+    part = inp.part[instance.part]
+    yield comment_line('',fill='*')
+    yield comment_line('Data for part ' + name + ', pid=' + str(pid))
+    yield comment_line('',fill='*')
+    yield '*DEFINE_TRANSFORMATION\n{:d}\n'.format(pid)
+    if instance.rotated:
+        axis = instance.rotation['b'] - instance.rotation['a']
+        yield 'ROTATE,{!r},{!r},{!r},0.0,0.0,0.0,{!r}\n'.format(
+            *axis.tolist(), float(instance.rotation['deg']))
+    yield 'TRANSL,{!r},{!r},{!r}\n'.format(*instance.translation.tolist())
+    yield '*INCLUDE_TRANSFORM\n' + filename + '\n'
+    # idnoff, ideoff, idpoff, idmoff, idsoff, idfoff, iddoff
+    yield '{:d},{:d},{:d},0,0,0,0\n'.format(node_offset, element_offset, pid - 1)
+    # idroff, -, prefix, suffix / fctmas, fcttim, fctlen, fcttem, incout1
+    yield '0\n1.0,1.0,1.0,,0\n'
+    yield '{:d}\n'.format(pid)
+    yield from _set_cards(inp, instance, part, node_offset, element_offset,
+                          generate_sets)
+
+def _part_include_cards(part):
+    yield comment_line('',fill='*')
+    yield comment_line('Part ' + part.name + ', for *INCLUDE_TRANSFORM')
+    yield comment_line('',fill='*')
+    yield from _part_cards(part, AbaqusInstance(), 1, 0, 0)
+    yield '*END\n'
+
+class _SharedTable():
+    """rows of write_cards columns copied into shared memory
+
+    Lets a worker process format the rows without the arrays being
+    pickled; the worker attaches by `name`.
+
+    """
+
+    def __init__(self, columns, start, stop):
+        width = sum(np.asarray(i).reshape(len(i), -1).shape[1]
+                    for i in columns)
+        self.shape = (stop - start, width)
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(8 * self.shape[0] * width, 1))
+        self.name = self.shm.name
+        table = np.ndarray(self.shape, buffer=self.shm.buf)
+        col = 0
+        for i in columns:
+            i = np.asarray(i[start:stop]).reshape(stop - start, -1)
+            table[:, col:col + i.shape[1]] = i
+            col += i.shape[1]
+        del table
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+def _format_cards(fmt, columns):
+    """write_cards into a string, in a worker process"""
+    out = io.StringIO()
+    write_cards(out, fmt, columns)
+    return out.getvalue()
+
+def _format_shared(name, shape, fmt):
+    """write_cards on a _SharedTable into a string, in a worker process"""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return _format_cards(fmt, [np.ndarray(shape, buffer=shm.buf)])
+    finally:
+        shm.close()
+
+def _pooled(pieces, pool, chunk):
+    """pieces with their card blocks formatted by a process pool
+
+    Card blocks are cut into chunks of `chunk` rows, each copied to shared
+    memory and formatted by a worker; they are replaced by the future of
+    the text, followed by a callable releasing the shared memory.  Without
+    shared memory (before Python 3.8) the chunks are pickled instead.
+    Blocks of fewer than `chunk` // 8 rows, such as most set cards, are
+    left to be formatted in this process, where that costs less than the
+    round trip to a worker.
+
+    """
+    for item in pieces:
+        if not isinstance(item, tuple):
+            yield item
+            continue
+        fmt, columns = item
+        rows = len(columns[0])
+        if rows < chunk // 8:
+            yield item
+            continue
+        for start in range(0, rows, chunk):
+            if shared_memory is None:
+                yield pool.submit(_format_cards, fmt, [
+                    i[start:start + chunk] for i in columns])
+                continue
+            table = _SharedTable(columns, start, min(start + chunk, rows))
+            yield pool.submit(_format_shared, table.name, table.shape, fmt)
+            yield table.release
+
+def _write_pieces(stream, pieces, window):
+    """write a sequence of output pieces in order
+
+    Pieces are text, write_cards card blocks, futures of text or callables
+    to call when they are reached.  At most `window` pieces are pending at
+    a time, which bounds the memory held by formatted chunks not yet
+    written.
+
+    """
+    pending = collections.deque()
+    def flush(n):
+        while len(pending) > n:
+            piece = pending.popleft()
+            if isinstance(piece, str):
+                stream.write(piece)
+            elif isinstance(piece, tuple):
+                write_cards(stream, *piece)
+            elif isinstance(piece, concurrent.futures.Future):
+                stream.write(piece.result())
             else:
-                to_write = status + '\r'
-            sys.stdout.write(to_write)
-            sys.stdout.flush()
+                piece()
+    try:
+        for piece in pieces:
+            pending.append(piece)
+            flush(window)
+        flush(0)
+    except BaseException:
+        # still release any shared memory of the pending chunks
+        for piece in pending:
+            if callable(piece):
+                piece()
+        raise
+
+def _model_pieces(inp, layout, progress, include, ostream, pool, chunk,
+                  window, generate_sets):
+    """output pieces of all instances, writing part files as needed
+
+    Card blocks are cut into blocks of up to `chunk` rows, each followed
+    by a progress update, so that a single large part reports progress
+    while it is written too.
+
+    """
+    written = {}
+    done = 0
+    for i in layout:
+        instance = inp.instance[i[0]]
+        part = inp.part[instance.part]
+        if include is not None and not (
+                instance.rotated and (part.element_section >= 0).any()):
+            if part.name not in written:
+                path = include(part.name)
+                with open(path, 'w') as f:
+                    pieces = _part_include_cards(part)
+                    if pool is not None:
+                        pieces = _pooled(pieces, pool, chunk)
+                    _write_pieces(f, pieces, window)
+                base = os.path.dirname(getattr(ostream, 'name', '') or '')
+                written[part.name] = os.path.relpath(path, base or '.')
+            pieces = _include_cards(inp, *i, written[part.name],
+                                    generate_sets=generate_sets)
+        else:
+            pieces = _instance_cards(inp, *i, generate_sets=generate_sets)
+        # the rows of the node and element cards come first; set cards are
+        # not counted
+        size = len(part.node) + len(part.element)
+        rows = 0
+        for piece in pieces:
+            if not isinstance(piece, tuple):
+                yield piece
+                continue
+            fmt, columns = piece
+            n = len(columns[0])
+            for start in range(0, n, chunk):
+                yield fmt, [c[start:start + chunk] for c in columns]
+                rows += min(chunk, n - start)
+                yield functools.partial(progress.update,
+                                        done + min(rows, size))
+        done += size
+        yield functools.partial(progress.update, done)
+
+def WriteDynaFromAbaqus(total_nodel, inp_name, abaqus_keyword, ostream,
+                        progress=None, jobs=1, chunk=100000, include=None,
+                        generate_sets=True):
+    """write the LS-DYNA keyword file for a parsed Abaqus model
+
+    `inp_name` names the input in the header; it may be None, for
+    standard input say.
+
+    With `jobs` > 1, cards are formatted in that many worker processes, in
+    chunks of up to `chunk` rows shared with the workers through shared
+    memory, and written in order; 0 uses one process per CPU.  Progress
+    is updated after every `chunk` card rows.
+
+    With `include`, each part is written once to a file of its own and its
+    instances are placed with *INCLUDE_TRANSFORM.  `include(part_name)`
+    returns the path to write the part file to.  The part files are named
+    in the keyword file by their path relative to `ostream.name`, if it
+    has one.  Rotated instances of parts with oriented elements are still
+    written in full, as the part file holds the orthotropic directions in
+    part coordinates.
+
+    With `generate_sets`, sets of consecutive labels are written as
+    *SET_..._GENERATE ranges where that takes fewer lines.
+
+    """
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    progress = Progress.create(progress, 'Compiling data', total_nodel,
+                               'cards')
 
     inp = abaqus_keyword
     output = {}
     output['header'] = (
         '$ LS-DYNA keyword input file\n' +
-        '$ Auto-translated from ' + inp_name +
+        '$ Auto-translated' +
+            ('' if inp_name is None else ' from ' + inp_name) +
             ' by abaqus2dyna.py\n')
     output['timestamp'] = ('$ translated at: ' +
         datetime.datetime.utcnow().strftime("%y-%m-%d %H:%M:%S UTC") + '\n')
-    output['data'] = tempfile.TemporaryFile(mode='w+')
-    output['stats'] = {}
-    output['stats']['pid'] = []
-    output['stats']['esid'] = []
-    output['stats']['nsid'] = []
-
-    def comment_line(string, fill='', newline=True):
-        ret = ('${:' + fill + '^78s}$').format(string)
-        if newline:
-            ret += '\n'
-        return ret
+    # cards go straight to the output; the statistics header that precedes
+    # them is worked out from the model beforehand
+    output['stats'] = _model_stats(inp)
+
     set_comment_sep = comment_line('',fill='-')
     set_comment_fmt = '${:>12s}{:12d}' + ' '*12 + '{:42s}$\n'
     set_comment_head = ('${:_>12s}{:_>12s}'+'_'*12 + '{:_<42s}$\n'
         ).format('type','id','name')
     output['sep'] = comment_line('',fill='*')
 
-    count = collections.Counter()
-    offset = collections.Counter()
-
-    # need to write nodes, then elements, then sets
-    for i in inp.instance:
-        #print('Writing instance ' + i)
-        count['part'] += 1
-        output['data'].write(comment_line('',fill='*'))
-        output['data'].write(comment_line('Data for part ' + i + ', pid=' + str(count['part'])))
-        output['data'].write(comment_line('',fill='*'))
-        instance = inp.instance[i]
-        rotation_matrix = instance.rotation_matrix
-        output['stats']['pid'].append([count['part'],instance.name])
-        # write nodes
-        offset['node'] = count['node']
-        offset['element'] = count['element']
-        #import pdb; pdb.set_trace()
-        if inp.part[instance.part].node:
-            output['data'].write('*NODE\n')
-            node_fmt = '{0:8d}{1[0]:16.8e}{1[1]:16.8e}{1[2]:16.8e}\n'
-            for j in inp.part[instance.part].node:
-                node = inp.part[instance.part].node[j]
-                id = node.id + offset['node']
-                orig_pos = node.pos
-                final_pos = rotation_matrix.dot(orig_pos) #rotation
-                final_pos += instance.translation #translation
-                output['data'].write(node_fmt.format(id,final_pos))
-                count['node'] += 1
-                update_term()
-        element_conversion = {'C3D8R':'SOLID',
-                              'S4R':'SHELL'}
-        if inp.part[instance.part].element:
-            current_type = None
-            current_has_orient = None
-            element_fmt = '{:8d}{:8d}{:8d}{:8d}{:8d}{:8d}{:8d}{:8d}{:8d}{:8d}\n'
-            for j in inp.part[instance.part].element:
-                element = inp.part[instance.part].element[j]
-                id = element.id + offset['element']
-                this_has_orient = False
-                this_orient = None
-                if element_conversion[element.type] == 'SOLID':
-                    for k in inp.part[instance.part].section:
-                        if element.id in inp.part[instance.part].set['element'][k.elset]:
-                            this_has_orient = True
-                            this_orient = inp.part[instance.part].orientation[k.orientation]
-                            continue
-                if element.type != current_type or this_has_orient != current_has_orient:
-                    output['data'].write('*ELEMENT_' + element_conversion[element.type])
-                    if this_has_orient:
-                        output['data'].write('_ORTHO')
-                    output['data'].write('\n')
-                    current_type = element.type
-                    current_has_orient = this_has_orient
-
-                nodes = (np.array(element.node) + offset['node']).tolist()
-                for k in range(8 - len(nodes)):
-                    nodes.append(0)
-                #import pdb; pdb.set_trace()
-                output['data'].write(element_fmt.format(id,count['part'],*nodes))
-                if current_has_orient:
-
-                    a = np.empty(3)
-                    d = np.empty(3)
-                    # get element centroid
-                    centroid = np.zeros(3)
-                    for k in element.node:
-                        centroid += inp.part[instance.part].node[k].pos
-                    centroid /= len(nodes)
-                    system = this_orient.system
-                    if system == 'CYLINDRICAL':
-                        #import pdb; pdb.set_trace()
-                        c = this_orient.b - this_orient.a
-                        c /= np.linalg.norm(c)
-                        g = centroid - this_orient.a # to centroid from a
-                        h = c.dot(g) # distance along _ab_ to centroid
-                        h = this_orient.a + h*c # vector along _ab_ to centroid
-                        a = centroid - h
-                        a /= np.linalg.norm(a)
-                        d = np.cross(c,a)
-                        # maybe an additional rotation?
-                        if this_orient.rot_axis == 1:
-                            axis_point = a
-                        elif this_orient.rot_axis == 2:
-                            axis_point = d
-                        else:
-                            axis_point = c
-                        rotation_matrix = GetRotationMatrix([0,0,0],axis_point,this_orient.rot)
-                        a = rotation_matrix.dot(a)
-                        d = rotation_matrix.dot(d)
-                        # rotate local CS with instance
-                        rotation_matrix = instance.rotation_matrix
-                        a = rotation_matrix.dot(a) #rotation
-                        #a += instance.translation #translation
-                        d = rotation_matrix.dot(d) #rotation
-                        #d += instance.translation #translation
-                        d /= np.linalg.norm(d)
-                        a /= np.linalg.norm(a)
-                        #import pdb; pdb.set_trace()
-                    if system in ['RECTANGULAR',None]:
-                        a = this_orient.a
-                        a /= np.linalg.norm(a)
-                        b = this_orient.b
-                        b /= np.linalg.norm(b)
-                        c = np.cross(a,b)
-                        d = np.cross(c,a)
-                        # maybe an additional rotation?
-                        if this_orient.rot_axis == 1:
-                            axis_point = a
-                        elif this_orient.rot_axis == 2:
-                            axis_point = d
-                        else:
-                            axis_point = c
-                        rotation_matrix = GetRotationMatrix([0,0,0],axis_point,this_orient.rot)
-                        a = rotation_matrix.dot(a)
-                        d = rotation_matrix.dot(d)
-                        # rotate local CS with instance
-                        rotation_matrix = instance.rotation_matrix
-                        a = rotation_matrix.dot(a) #rotation
-                        #a += instance.translation #translation
-                        d = rotation_matrix.dot(d) #rotation
-                        #d += instance.translation #translation
-                        d /= np.linalg.norm(d)
-                        a /= np.linalg.norm(a)
-                        #import pdb; pdb.set_trace()
-                    else:
-                        raise Exception('yep, ' + system + ' not yet implemented')
-                    output['data'].write('{0[0]:16.7e}{0[1]:16.7e}{0[2]:16.7e}\n'.format(a))
-                    output['data'].write('{0[0]:16.7e}{0[1]:16.7e}{0[2]:16.7e}\n'.format(d))
-                count['element'] += 1
-                update_term()
-        # sets
-        for k in inp.set['element']:
-            if inp.set['element'][k].instance == instance.name:
-                #TODO, need to check that all elements are same type (for DYNA sake)
-                start = True
-                set_naming_parts = k.split(':')
-                set_name = set_naming_parts[1]
-                set_id = int(set_naming_parts[0][1:])
-                tmp_element_count = 0
-                for m in inp.set['element'][k]:
-                    if start:
-                        element = inp.part[instance.part].element[m]
-                        output['data'].write('*SET_' + element_conversion[element.type] + '\n')
-                        output['data'].write('{:10d}\n'.format(set_id))
-                        start = False
-                    if tmp_element_count > 7:
-                        output['data'].write('\n')
-                        tmp_element_count = 0
-                    output['data'].write('{:10d}'.format(m + offset['element']))
-                    tmp_element_count += 1
-                if tmp_element_count <= 8:
-                    output['data'].write('\n')
-                count['elset'] += 1
-                output['stats']['esid'].append([set_id,set_name])
-        for k in inp.set['node']:
-            if inp.set['node'][k].instance == instance.name:
-                #TODO, need to check that all elements are same type (for DYNA sake)
-                start = True
-                set_naming_parts = k.split(':')
-                set_name = set_naming_parts[1]
-                set_id = int(set_naming_parts[0][1:])
-                tmp_node_count = 0
-                for m in inp.set['node'][k]:
-                    if start:
-                        output['data'].write('*SET_NODE\n')
-                        output['data'].write('{:10d}\n'.format(set_id))
-                        start = False
-                    if tmp_node_count > 7:
-                        output['data'].write('\n')
-                        tmp_node_count = 0
-                    output['data'].write('{:10d}'.format(m + offset['node']))
-                    tmp_node_count += 1
-                if tmp_node_count <= 8:
-                    output['data'].write('\n')
-                count['nodeset'] += 1
-                output['stats']['nsid'].append([set_id,set_name])
-
-    update_term(True)
     k = ostream
     k.write(output['header'])
     k.write(output['timestamp'])
@@ -597,15 +2469,150 @@ def WriteDynaFromAbaqus(total_nodel, inp_name, abaqus_keyword, ostream):
         for j in output['stats'][i]:
             k.write(set_comment_fmt.format(i,j[0],j[1]))
         k.write(set_comment_sep)
-    output['data'].seek(0)
-    k.write(output['sep'] + output['data'].read())
-    output['data'].close()
+    k.write(output['sep'])
+
+    # need to write nodes, then elements, then sets
+    layout = instance_layout(inp)
+    pool = None
+    if jobs > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(jobs)
+    try:
+        pieces = _model_pieces(inp, layout, progress, include, ostream, pool,
+                               chunk, 4 * jobs, generate_sets)
+        if pool is not None:
+            pieces = _pooled(pieces, pool, chunk)
+        _write_pieces(k, pieces, 4 * jobs)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    progress.finish()
     k.write(output['sep'])
     k.write('*END\n')
     k.write(comment_line('End of translated output.', fill='-', newline=False))
     return
 
 
+# compressed input and output, by file name extension
+
+COMPRESSION = {'.gz': gzip, '.bz2': bz2, '.xz': lzma}
+
+def compression(filename):
+    """the module (gzip, bz2 or lzma) compressing `filename`, or None"""
+    return COMPRESSION.get(os.path.splitext(filename)[1].lower())
+
+def _compression_options(codec, level):
+    if level is None:
+        return {}
+    return {'preset': level} if codec is lzma else {'compresslevel': level}
+
+class _DecompressedText(io.TextIOWrapper):
+    # bz2 and lzma files have no name; this one has that of the file
+    name = None
+
+def open_input(filename):
+    """text stream of an input file, decompressed as its extension says"""
+    codec = compression(filename)
+    if codec is None:
+        return open(filename)
+    ret = _DecompressedText(codec.open(filename, 'rb'))
+    ret.name = filename
+    return ret
+
+class _ThreadWriter(io.RawIOBase):
+    """binary stream handing its writes to a thread writing to `target`"""
+
+    def __init__(self, target, name, depth=8):
+        self.target = target
+        self.name = name
+        self.queue = queue.Queue(depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        data = b''
+        try:
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                self.target.write(data)
+            self.target.close()
+        except BaseException as e:
+            self.error = e
+            # keep taking writes so that the writer is not blocked
+            while data is not None:
+                data = self.queue.get()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.queue.put(None)
+            self.thread.join()
+            super().close()
+            if self.error is not None:
+                raise self.error
+
+class _ProcessWriter(io.RawIOBase):
+    """binary stream piped to a child process compressing to a file"""
+
+    CHILD = ('import shutil, sys, {0}\n'
+             'with {0}.open(sys.argv[1], "wb", **{1!r}) as f:\n'
+             '    shutil.copyfileobj(sys.stdin.buffer, f, 1 << 20)\n')
+
+    def __init__(self, codec, filename, options):
+        self.name = filename
+        code = self.CHILD.format(codec.__name__, options)
+        self.process = subprocess.Popen([sys.executable, '-c', code, filename],
+                                        stdin=subprocess.PIPE)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.process.stdin.write(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.process.stdin.close()
+            status = self.process.wait()
+            super().close()
+            if status:
+                raise OSError('compressing {} failed with status {}'.format(
+                    self.name, status))
+
+def open_output(filename, level=None, worker=None):
+    """text stream writing `filename`, compressed as its extension says
+
+    `level` is the compression level (the preset of xz).  With `worker`
+    'thread' or 'process', data is compressed by a thread or a child
+    process, overlapping with the formatting of the cards.
+
+    """
+    codec = compression(filename)
+    if codec is None:
+        return open(filename, 'w')
+    options = _compression_options(codec, level)
+    if worker is None:
+        return codec.open(filename, 'wt', **options)
+    if worker == 'thread':
+        raw = _ThreadWriter(codec.open(filename, 'wb', **options), filename)
+    elif worker == 'process':
+        raw = _ProcessWriter(codec, filename, options)
+    else:
+        raise ValueError('unknown compression worker: {}'.format(worker))
+    return io.TextIOWrapper(io.BufferedWriter(raw, 1 << 20))
+
 def cmdline(argv = None):
     """ command line processor
 
@@ -626,19 +2633,129 @@ def cmdline(argv = None):
                         version='%(prog)s ' + version)
     parser.add_argument('input',
                         metavar='INPUT',
-                        help='Abaqus keyword file')
+                        nargs='+',
+                        help='Abaqus keyword file, - for standard input; '
+                             'several files, glob patterns or @MANIFEST files '
+                             'listing inputs convert a batch')
     parser.add_argument('-o', '--output',
                         dest='output',
                         metavar='OUTPUT',
-                        help='LS-DYNA keyword file output location')
+                        help='LS-DYNA keyword file output location '
+                             '(default, or -: standard output); for a batch, '
+                             'a template of {dir}, {name} and {stem} of each '
+                             'input (default: {dir}/{stem}.k)')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        metavar='N',
+                        help='number of worker processes parsing input and '
+                             'formatting output, or converting the files of '
+                             'a batch (0: one per CPU)')
+    parser.add_argument('--failed-list',
+                        metavar='FILE',
+                        help='write the inputs of a batch that failed to '
+                             'FILE, for use as @FILE')
+    parser.add_argument('--include-parts',
+                        action='store_true',
+                        help='write each part once to OUTPUT_<part>.k and '
+                             'place its instances with *INCLUDE_TRANSFORM '
+                             '(requires -o)')
+    parser.add_argument('--explicit-sets',
+                        action='store_true',
+                        help='list every set member, never use '
+                             '*SET_..._GENERATE ranges')
+    parser.add_argument('--instances',
+                        action='append',
+                        metavar='NAMES',
+                        help='convert only these instances (comma separated '
+                             'names or patterns; may be repeated)')
+    parser.add_argument('--parts',
+                        action='append',
+                        metavar='NAMES',
+                        help='convert only the instances of these parts')
+    parser.add_argument('--sets',
+                        action='append',
+                        metavar='NAMES',
+                        help='write only these assembly sets')
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='look INPUT up in the parsed model cache, and '
+                             'save its model there after parsing')
+    parser.add_argument('--cache-dir',
+                        metavar='DIR',
+                        help='use the parsed model cache in DIR (--cache '
+                             'uses $ABAQUS2DYNA_CACHE or ~/.cache/abaqus2dyna)')
+    parser.add_argument('--cache-size',
+                        type=int,
+                        default=4096,
+                        metavar='MB',
+                        help='size limit of the parsed model cache; least '
+                             'recently used models are removed beyond it')
+    parser.add_argument('--clear-cache',
+                        action='store_true',
+                        help='empty the parsed model cache first')
+    parser.add_argument('--index',
+                        action='store_true',
+                        help='keep a keyword index of INPUT in '
+                             'INPUT.kwindex, and parse along it')
+    parser.add_argument('--stats',
+                        action='store_true',
+                        help='only print the keyword and line counts of '
+                             'INPUT, from its keyword index')
+    parser.add_argument('--compress-level',
+                        type=int,
+                        metavar='N',
+                        help='compression level of an OUTPUT ending in .gz, '
+                             '.bz2 or .xz (INPUT may be compressed likewise)')
+    parser.add_argument('--compress-worker',
+                        choices=['thread', 'process'],
+                        help='compress OUTPUT in a thread or a child process, '
+                             'while the cards are formatted')
+    parser.add_argument('-q', '--quiet',
+                        action='store_true',
+                        help='do not report progress on stderr')
     args = parser.parse_args(argv)
+    try:
+        args.inputs = expand_inputs(args.input)
+    except OSError as e:
+        parser.error('cannot read manifest: {}'.format(e))
+    args.batch = len(args.inputs) != 1 or '{' in (args.output or '')
+    if args.batch:
+        if '-' in args.inputs:
+            parser.error('- cannot be part of a batch')
+        if args.stats:
+            parser.error('--stats takes a single INPUT')
+        if args.output == '-':
+            parser.error('a batch cannot be written to standard output')
+        args.files = [(i, batch_output(i, args.output or BATCH_OUTPUT))
+                      for i in args.inputs]
+        outputs = collections.Counter(i[1] for i in args.files)
+        if outputs and outputs.most_common(1)[0][1] > 1:
+            parser.error('several inputs would be written to {}'.format(
+                outputs.most_common(1)[0][0]))
+        args.input = None
+    else:
+        args.input = args.inputs[0]
+    if args.output == '-':
+        args.output = None
+    if args.include_parts and not (args.output or args.batch):
+        parser.error('--include-parts requires -o/--output')
+    if args.stats and (args.input == '-' or compression(args.input)):
+        parser.error('--stats requires an uncompressed INPUT file')
+    for name in ('instances', 'parts', 'sets'):
+        names = getattr(args, name)
+        if names is not None:
+            setattr(args, name, [j.strip() for i in names
+                                 for j in i.split(',') if j.strip()])
 
     return args
 
 
-def convert(fin, fout):
+def convert(fin, fout, progress=None, jobs=1, include=None,
+            generate_sets=True, cache=None, index=None, select=None):
 
-    inp = ParseAbaqus(fin)
+    inp = ParseAbaqus(fin, progress, cache, jobs=jobs, index=index,
+                      select=select)
     #print(inp.count)
 
     # get nodes + elements (these will take the longest)
@@ -648,21 +2765,201 @@ def convert(fin, fout):
         total_nodel += len(part.node)
         total_nodel += len(part.element)
 
-    # finally, output dyna keyword
-    WriteDynaFromAbaqus(total_nodel, fin.name, inp, fout)
+    # finally, output dyna keyword; standard input ('<stdin>') is unnamed
+    name = getattr(fin, 'name', None)
+    if not isinstance(name, str) or name.startswith('<'):
+        name = None
+    WriteDynaFromAbaqus(total_nodel, name, inp, fout, progress, jobs,
+                        include=include, generate_sets=generate_sets)
+    return inp
+
+def part_include_path(output, part_name):
+    """path of the part file for --include-parts next to `output`
+
+    Part files are not compressed, whatever `output` is.
+
+    """
+    name = re.sub(r'[^\w.-]', '_', part_name)
+    if compression(output):
+        output = os.path.splitext(output)[0]
+    return os.path.splitext(output)[0] + '_' + name + '.k'
+
+# batch conversion
+
+BATCH_OUTPUT = os.path.join('{dir}', '{stem}.k')
+
+def expand_inputs(args):
+    """input paths from the INPUT arguments
+
+    An argument @FILE is a manifest listing inputs one per line, blank and
+    '#' lines aside.  Arguments with wildcards are expanded by glob, in
+    sorted order; a pattern matching nothing is kept as it is, to fail.
+    Inputs given more than once are converted once.
+
+    """
+    ret = []
+    for arg in args:
+        if arg.startswith('@'):
+            with open(arg[1:]) as f:
+                ret.extend(i.strip() for i in f
+                           if i.strip() and not i.lstrip().startswith('#'))
+        elif arg != '-' and re.search(r'[*?[]', arg):
+            ret.extend(sorted(glob.glob(arg)) or [arg])
+        else:
+            ret.append(arg)
+    return list(dict.fromkeys(ret))
+
+def batch_output(input, template):
+    """output path of `input` from a template of its {dir}, {name} and
+    {stem}, the name without its extensions (.inp, .inp.gz, ...)"""
+    name = os.path.basename(input)
+    stem = name
+    if compression(stem):
+        stem = os.path.splitext(stem)[0]
+    stem = os.path.splitext(stem)[0]
+    return os.path.normpath(template.format(
+        dir=os.path.dirname(input) or '.', name=name, stem=stem))
+
+BatchResult = collections.namedtuple(
+    'BatchResult', ['input', 'output', 'seconds', 'nodes', 'elements',
+                    'error'])
+
+def convert_file(input, output, include_parts=False, compress_level=None,
+                 compress_worker=None, **kwargs):
+    """convert the file `input` to the file `output`; a BatchResult
+
+    An exception is not raised but recorded as `error`, and the output
+    written so far removed.  Files are opened with open_input and
+    open_output, and other arguments passed to convert, `progress` being
+    False unless given.
+
+    """
+    start = time.monotonic()
+    kwargs.setdefault('progress', False)
+    if include_parts:
+        kwargs['include'] = functools.partial(part_include_path, output)
+    fout = None
+    try:
+        with open_input(input) as fin:
+            directory = os.path.dirname(output)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fout = open_output(output, compress_level, compress_worker)
+            with fout:
+                inp = convert(fin, fout, **kwargs)
+    except Exception as e:
+        if fout is not None:
+            try:
+                os.unlink(output)
+            except OSError:
+                pass
+        return BatchResult(input, output, time.monotonic() - start, 0, 0,
+                           '{}: {}'.format(type(e).__name__, e))
+    parts = [inp.part[i.part] for i in inp.instance.values()]
+    return BatchResult(input, output, time.monotonic() - start,
+                       sum(len(i.node) for i in parts),
+                       sum(len(i.element) for i in parts), None)
+
+def convert_batch(files, jobs=1, **kwargs):
+    """convert (input, output) pairs of files, yielding their BatchResults
+
+    With `jobs` > 1 (0: one per CPU), the files are converted by that many
+    worker processes, each file by a single one, and the results come as
+    the files are done.  A failing file does not stop the others.
+    Arguments are those of convert_file.
+
+    """
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1:
+        for input, output in files:
+            yield convert_file(input, output, **kwargs)
+        return
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = {pool.submit(convert_file, input, output, **kwargs):
+                   (input, output) for input, output in files}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # the worker process died
+                yield BatchResult(*futures[future], 0.0, 0, 0,
+                                  '{}: {}'.format(type(e).__name__, e))
+
+def _run_batch(args, stream, **kwargs):
+    """convert the files of a batch, writing a line per file and a total"""
+    start = time.monotonic()
+    failed = []
+    for result in convert_batch(args.files, args.jobs, **kwargs):
+        if result.error is None:
+            stream.write('ok     {:7.1f}s  {} -> {} ({} nodes, {} elements)'
+                         '\n'.format(result.seconds, result.input,
+                                     result.output, result.nodes,
+                                     result.elements))
+        else:
+            failed.append(result.input)
+            stream.write('FAILED {:7.1f}s  {}: {}\n'.format(
+                result.seconds, result.input, result.error))
+        stream.flush()
+    stream.write('{} of {} files converted in {:.1f}s, {} failed\n'.format(
+        len(args.files) - len(failed), len(args.files),
+        time.monotonic() - start, len(failed)))
+    if args.failed_list:
+        with open(args.failed_list, 'w') as f:
+            f.writelines(i + '\n' for i in failed)
+    return 1 if failed else 0
 
 def main():
     args = cmdline()
-    with open(args.input) as fin:
+    if args.stats:
+        with open(args.input) as fin:
+            index = KeywordIndex.for_file(args.input, save=args.index,
+                                          encoding=fin.encoding)
+        write_keyword_stats(index, sys.stdout)
+        return
+    select = None
+    if args.instances or args.parts or args.sets:
+        select = Selection(args.instances, args.parts, args.sets)
+    include = None
+    if args.include_parts:
+        include = functools.partial(part_include_path, args.output)
+    # the cache is opt-in: a stale or foreign cache directory must never
+    # silently stand in for parsing INPUT
+    cache = None
+    if args.cache or args.cache_dir is not None:
+        cache = ModelCache(args.cache_dir, args.cache_size << 20)
+    if args.clear_cache:
+        (cache or ModelCache(args.cache_dir)).clear()
+    if args.batch:
+        return _run_batch(args, sys.stdout,
+                          include_parts=args.include_parts,
+                          compress_level=args.compress_level,
+                          compress_worker=args.compress_worker,
+                          generate_sets=not args.explicit_sets, cache=cache,
+                          index=True if args.index else None, select=select)
+    if args.input == '-':
+        fin = sys.stdin
+    else:
+        fin = open_input(args.input)
+    if args.output:
+        fout = open_output(args.output, args.compress_level,
+                           args.compress_worker)
+    else:
+        fout = sys.stdout
+    try:
+        convert(fin, fout, False if args.quiet else None, args.jobs, include,
+                not args.explicit_sets, cache, True if args.index else None,
+                select)
+    except BrokenPipeError:
+        # the reader of standard output went away; do not complain again
+        # when Python flushes it at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
         if args.output:
-            fout = open(args.output, 'w')
-        else:
-            fout = sys.stdout
-        try:
-            return convert(fin, fout)
-        finally:
-            if args.output:
-                fout.close()
+            fout.close()
 
 if __name__ == '__main__':
     sys.exit(main())
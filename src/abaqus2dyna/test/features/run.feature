@@ -3,5 +3,10 @@ Feature: full test
   Scenario: example.inp
     Given example.inp
     When we convert it
+    Then we expect an output file with 69224 lines
+
+  Scenario: example.inp with explicit sets
+    Given example.inp
+    When we convert it with explicit sets
     Then we expect an output file with 69722 lines
 
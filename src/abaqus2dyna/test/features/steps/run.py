@@ -14,6 +14,12 @@ def step_impl(context):
     with open(context.name) as fin:
         abaqus2dyna.__main__.convert(fin, context.out)
 
+@when("we convert it with explicit sets")
+def step_impl(context):
+    context.out = io.StringIO()
+    with open(context.name) as fin:
+        abaqus2dyna.__main__.convert(fin, context.out, generate_sets=False)
+
 @then('we expect an output file with {number:d} lines')
 def step_impl(context, number):
     context.out.seek(0)
@@ -0,0 +1,326 @@
+import io
+
+import abaqus2dyna.__main__ as a2d
+
+SIMPLE = """*Heading
+** comment
+*Part, name=Cube
+*Node
+      1,           0.,           0.,           0.
+      2,           1.,           0.,           0.
+      3,           1.,           1.,           0.
+      4,           0.,           1.,           0.
+      5,           0.,           0.,           1.
+      6,           1.,           0.,           1.
+      7,           1.,           1.,           1.
+      8,           0.,           1.,           1.
+*Element, type=C3D8R
+1, 5, 6, 7, 8, 1, 2, 3, 4
+*Nset, nset=Bottom
+ 1, 2, 3, 4
+*Elset, elset=All, generate
+ 1, 1, 1
+*End Part
+*Assembly, name=Assembly
+*Instance, name=Cube-1, part=Cube
+          1.,           2.,           3.
+*End Instance
+*Nset, nset=#01:Top, instance=Cube-1, generate
+ 5, 8, 1
+*End Assembly
+"""
+
+def parse(text):
+    return a2d.ParseAbaqus(io.StringIO(text))
+
+def test_parse_simple():
+    inp = parse(SIMPLE)
+    part = inp.part['Cube']
+    assert len(part.node) == 8
+    assert list(part.node[7].pos) == [1, 1, 1]
+    assert part.element[1].node == [5, 6, 7, 8, 1, 2, 3, 4]
+    assert part.element[1].type == 'C3D8R'
+    assert list(part.set['node']['Bottom']) == [1, 2, 3, 4]
+    assert list(part.set['element']['All']) == [1]
+    assert list(inp.instance['Cube-1'].translation) == [1, 2, 3]
+    assert list(inp.set['node']['#01:Top']) == [5, 6, 7, 8]
+    assert inp.count['comment'] == 1
+    assert inp.count['*NODE'] == 1
+
+def test_register_keyword():
+    seen = []
+
+    @a2d.register_keyword('MY KEYWORD')
+    class MyHandler(a2d.KeywordHandler):
+        def begin(self, kwargs):
+            seen.append(kwargs)
+
+        def data(self, line):
+            seen.append(line.strip())
+
+    try:
+        parse('*My Keyword, Flag, value="x"\n1, 2\n*Part, name=P\n')
+    finally:
+        del a2d.KEYWORD_HANDLERS['MY KEYWORD']
+    assert seen == [{'flag': True, 'value': 'x'}, '1, 2']
+
+def test_parse_nodes_2d():
+    inp = parse('*Part, name=P\n*Node\n1, 1., 2.\n2, 3., 4.\n*Node\n3, 5., 6., 7.\n')
+    part = inp.part['P']
+    assert list(part.node) == [1, 2, 3]
+    assert list(part.node[2].pos) == [3, 4, 0]
+    assert list(part.node[3].pos) == [5, 6, 7]
+
+def test_parse_nodes_trailing_comma():
+    for text in ('1, 0., 0., 0., \n2, 1., 0., 0., \n3, 1., 1., 0.\n',
+                 '1, 0., 0., 0.,\n2, 1., 0., 0.\n\n3, 1., 1.\n'):
+        part = parse('*Part, name=P\n*Node\n' + text).part['P']
+        assert part.node_id.tolist() == [1, 2, 3]
+        assert part.node_pos.tolist() == [[0, 0, 0], [1, 0, 0], [1, 1, 0]]
+
+def test_parse_records_ragged():
+    records = a2d._parse_records(['1, 2., 3.\n', '2, 4., 5., 6.\n', '\n'])
+    assert records.tolist() == [[1, 2, 3, 0], [2, 4, 5, 6]]
+
+def test_parse_elements_continued():
+    inp = parse('*Part, name=P\n*Element, type=C3D10\n'
+                '1, 1, 2, 3, 4, 5, 6,\n7, 8, 9, 10\n'
+                '2, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20\n')
+    part = inp.part['P']
+    assert part.element[1].node == list(range(1, 11))
+    assert part.element[2].node == list(range(11, 21))
+    assert part.element[2].type == 'C3D10'
+
+def test_parse_elements_trailing_comma():
+    import pytest
+    lines = ''.join('{}, 1, 2, 3, 4, 5, 6, 7, 8, \n'.format(i) for i in range(1, 10))
+    part = parse('*Part, name=P\n*Element, type=C3D8R\n' + lines).part['P']
+    assert part.element_id.tolist() == list(range(1, 10))
+    assert part.element[9].node == list(range(1, 9))
+    part = parse('*Part, name=P\n*Element, type=C3D8R\n'
+                 '1, 1, 2, 3, 4, 5, 6, 7, 8, \n2, 1, 2, 3, 4, 5, 6, 7, 8\n').part['P']
+    assert part.element_id.tolist() == [1, 2]
+    for bad in ('1, 1, 2, 3, 4, 5, 6, 7, 8, 9\n', '1, 1, , 3, 4, 5, 6, 7, 8\n'):
+        with pytest.raises(ValueError):
+            parse('*Part, name=P\n*Element, type=C3D8R\n' + bad)
+
+def test_id_index():
+    import numpy as np
+    for ids in ([5, 3, 9, 4], [5, 3, 10**9, 4]):
+        index = a2d.IdIndex(np.array(ids))
+        assert index.rows([3, ids[2], 7]).tolist() == [1, 2, -1]
+        assert index.row(4) == 3
+        try:
+            index.row(7)
+        except KeyError:
+            pass
+        else:
+            assert False
+
+def test_part_columns():
+    inp = parse(SIMPLE + '*Part, name=Mixed\n*Element, type=S4R\n1, 1, 2, 3, 4\n'
+                '*Element, type=C3D8R\n2, 1, 2, 3, 4, 5, 6, 7, 8\n*End Part\n')
+    part = inp.part['Mixed']
+    assert part.element_id.tolist() == [1, 2]
+    assert part.element_node.shape == (2, 8)
+    assert [part.element_types[i] for i in part.element_type] == ['S4R', 'C3D8R']
+    assert part.element[1].node == [1, 2, 3, 4]
+    assert inp.part['Cube'].node_pos.shape == (8, 3)
+
+def test_set_segments():
+    import numpy as np
+    s = a2d.Set()
+    s.add_range(1, 5000001, 2)
+    s.extend([7, 2, 7])
+    assert len(s) == 2500004
+    assert 4999999 in s and 2 in s and 4 not in s
+    assert s.contains(np.array([1, 2, 4, 7])).tolist() == [True, True, False, True]
+    assert list(s)[-3:] == [7, 2, 7]
+    assert len(s.to_array()) == len(s)
+
+def test_parse_set_blank_line():
+    inp = parse('*Part, name=P\n*Nset, nset=N\n1, 2,\n\n3\n')
+    assert list(inp.part['P'].set['node']['N']) == [1, 2, 3]
+
+def test_parse_set_trailing_comma(tmp_path):
+    source = tmp_path / 'sets.inp'
+    source.write_text('*Part, name=P\n*Nset, nset=A\n1, 2, \n'
+                      '*Elset, elset=B\n1, \n4,\t\n*End Part\n')
+    for mapped in (False, True):
+        with open(str(source)) as f:
+            part = a2d.ParseAbaqus(f, progress=False, mapped=mapped).part['P']
+        assert list(part.set['node']['A']) == [1, 2]
+        assert list(part.set['element']['B']) == [1, 4]
+
+def test_element_section():
+    inp = parse('*Part, name=P\n*Element, type=C3D8R\n'
+                '1, 1, 2, 3, 4, 5, 6, 7, 8\n2, 1, 2, 3, 4, 5, 6, 7, 8\n'
+                '3, 1, 2, 3, 4, 5, 6, 7, 8\n'
+                '*Elset, elset=A, generate\n1, 3, 1\n*Elset, elset=B\n3\n'
+                '*Orientation, name=OA\n1., 0., 0., 0., 1., 0.\n'
+                '*Orientation, name=OB\n1., 0., 0., 0., 1., 0.\n'
+                '*Solid Section, elset=A, orientation=OA, material=M\n'
+                '*Solid Section, elset=B, orientation=OB, material=M\n')
+    part = inp.part['P']
+    assert part.element_section.tolist() == [0, 0, 1]
+    assert [part.section[i].orientation
+            for i in part.element_section] == ['OA', 'OA', 'OB']
+
+def test_instance_transform():
+    import numpy as np
+    instance = a2d.AbaqusInstance()
+    instance.translation[:] = [1, 2, 3]
+    instance.rotation['b'][:] = [0, 0, 1]
+    instance.rotation['deg'] = 90
+    pos = np.random.RandomState(0).rand(10, 3)
+    expected = [instance.rotation_matrix.dot(i) + instance.translation for i in pos]
+    assert np.allclose(instance.transform(pos), expected, rtol=1e-15)
+
+def test_write_cards():
+    import numpy as np
+    out = io.StringIO()
+    ids = np.arange(1, 5)
+    pos = np.random.RandomState(1).randn(4, 3)
+    a2d.write_cards(out, a2d.NODE_CARD, [ids, pos], block=3)
+    expected = ''.join('{0:8d}{1[0]:16.8e}{1[1]:16.8e}{1[2]:16.8e}\n'.format(i, p)
+                       for i, p in zip(ids, pos))
+    assert out.getvalue() == expected
+
+def test_orthotropic_axes_cylindrical():
+    import numpy as np
+    orient = a2d.Orientation()
+    orient.system = 'CYLINDRICAL'
+    orient.a[:] = [0, 0, 0]
+    orient.b[:] = [0, 0, 1]
+    instance = a2d.AbaqusInstance()
+    a, d = a2d.orthotropic_axes(orient, [[2, 0, 5], [0, 3, 1]], instance)
+    assert np.allclose(a, [[1, 0, 0], [0, 1, 0]])
+    assert np.allclose(d, [[0, 1, 0], [-1, 0, 0]])
+    orient.rot_axis = 3
+    orient.rot = 90
+    a, d = a2d.orthotropic_axes(orient, [[2, 0, 5]], instance)
+    assert np.allclose(a, [[0, 1, 0]])
+
+def test_progress_callback():
+    reports = []
+    a2d.ParseAbaqus(io.StringIO(SIMPLE), progress=reports.append)
+    assert reports and reports[-1].finished
+    assert reports[-1].label == 'Parsing'
+
+def test_progress_reused():
+    reports = []
+    progress = a2d.Progress('', interval=0,
+                            callback=lambda p: reports.append((p.label, p.finished)))
+    inp = a2d.ParseAbaqus(io.StringIO(SIMPLE), progress=progress)
+    reports.clear()
+    a2d.WriteDynaFromAbaqus(16, 'test.inp', inp, io.StringIO(), progress=progress)
+    assert reports[-1] == ('Compiling data', True)
+    assert ('Compiling data', True) not in reports[:-1]
+
+def test_instance_sets():
+    inp = parse(SIMPLE)
+    assert [k for k, s in inp.instance_sets('node', 'Cube-1')] == ['#01:Top']
+    assert list(inp.instance_sets('element', 'Cube-1')) == []
+
+def test_save_load_model():
+    import numpy as np
+    inp = parse(SIMPLE)
+    f = io.BytesIO()
+    a2d.save_model(inp, f)
+    f.seek(0)
+    loaded = a2d.load_model(f)
+    part = loaded.part['Cube']
+    assert np.array_equal(part.node_pos, inp.part['Cube'].node_pos)
+    assert part.element[1].node == [5, 6, 7, 8, 1, 2, 3, 4]
+    assert part.set['element']['All'].segments == [range(1, 2)]
+    assert list(part.set['node']['Bottom']) == [1, 2, 3, 4]
+    assert list(loaded.instance['Cube-1'].translation) == [1, 2, 3]
+    assert list(loaded.set['node']['#01:Top']) == [5, 6, 7, 8]
+    assert loaded.count == inp.count
+
+def test_model_cache(tmp_path):
+    source = tmp_path / 'model.inp'
+    source.write_text(SIMPLE)
+    cache = a2d.ModelCache(str(tmp_path / 'cache'))
+    with open(str(source)) as f:
+        a2d.ParseAbaqus(f, progress=False, cache=cache)
+    assert len(cache.entries()) == 1
+    reports = []
+    with open(str(source)) as f:
+        inp = a2d.ParseAbaqus(f, progress=reports.append, cache=cache)
+    assert not reports
+    assert list(inp.set['node']['#01:Top']) == [5, 6, 7, 8]
+    cache.max_size = 0
+    cache.evict()
+    assert cache.entries() == []
+
+def test_parse_mapped(tmp_path):
+    import numpy as np
+    # CRLF line ends and a comment splitting a node block
+    text = SIMPLE.replace('      5,', '** upper nodes\n      5,')
+    source = tmp_path / 'model.inp'
+    source.write_bytes(text.replace('\n', '\r\n').encode())
+    with open(str(source)) as f:
+        assert a2d._map_file(f) is not None
+        mapped = a2d.ParseAbaqus(f, progress=False)
+    with open(str(source)) as f:
+        lines = a2d.ParseAbaqus(f, progress=False, mapped=False)
+    assert mapped.count == lines.count
+    assert mapped.count['comment'] == 2
+    part = mapped.part['Cube']
+    assert np.array_equal(part.node_pos, lines.part['Cube'].node_pos)
+    assert part.element[1].node == [5, 6, 7, 8, 1, 2, 3, 4]
+    assert list(part.set['node']['Bottom']) == [1, 2, 3, 4]
+    assert list(part.set['element']['All']) == [1]
+    assert list(mapped.instance['Cube-1'].translation) == [1, 2, 3]
+    assert list(mapped.set['node']['#01:Top']) == [5, 6, 7, 8]
+
+def test_parse_jobs(tmp_path, monkeypatch):
+    import numpy as np
+    source = tmp_path / 'model.inp'
+    source.write_text(SIMPLE.replace('*Nset, nset=Bottom',
+                                     '*Element, type=S4R\n2, 1, 2, 3, 4\n'
+                                     '*Nset, nset=Bottom'))
+    monkeypatch.setattr(a2d.AbaqusParser, 'min_block', 0)
+    with open(str(source)) as f:
+        inp = a2d.ParseAbaqus(f, progress=False, jobs=2)
+    part = inp.part['Cube']
+    assert np.array_equal(part.node_pos, parse(SIMPLE).part['Cube'].node_pos)
+    assert part.element_types == ['C3D8R', 'S4R']
+    assert part.element[2].node == [1, 2, 3, 4]
+    assert part.element[2].type == 'S4R'
+
+def test_keyword_index(tmp_path):
+    import numpy as np
+    text = SIMPLE.replace('      5,', '** upper nodes\n      5,')
+    source = tmp_path / 'model.inp'
+    source.write_text(text)
+    filename = str(source)
+    assert a2d.KeywordIndex.for_file(filename, build=False) is None
+    index = a2d.KeywordIndex.for_file(filename)
+    assert index.entries[2].keyword == 'NODE'
+    assert index.entries[2].lines == 8
+    assert index.entries[3].params == {'type': 'C3D8R'}
+    count, lines = a2d.KeywordIndex.load(filename).stats()
+    with open(filename) as f:
+        inp = a2d.ParseAbaqus(f, progress=False, index=False)
+    assert count == inp.count
+    assert lines['*NSET'] == 2
+    with open(filename) as f:
+        indexed = a2d.ParseAbaqus(f, progress=False)
+    assert indexed.count == inp.count
+    assert np.array_equal(indexed.part['Cube'].node_pos,
+                          inp.part['Cube'].node_pos)
+    assert list(indexed.set['node']['#01:Top']) == [5, 6, 7, 8]
+    source.write_text(text + '** changed\n')
+    assert a2d.KeywordIndex.load(filename) is None
+
+def test_parse_mapped_error(tmp_path):
+    import pytest
+    source = tmp_path / 'bad.inp'
+    source.write_text('*Part, name=P\n*Node\n1, 0., 0., 0.\n2, 1., 0., x\n'
+                      '*End Part\n')
+    for index in (False, True):
+        with open(str(source)) as f:
+            with pytest.raises(ValueError):
+                a2d.ParseAbaqus(f, progress=False, index=index)
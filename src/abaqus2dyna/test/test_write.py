@@ -0,0 +1,174 @@
+import io
+
+import abaqus2dyna.__main__ as a2d
+
+from .test_parse import SIMPLE
+
+ASSEMBLY = SIMPLE.replace('*End Assembly\n', """*Instance, name=Cube-2, part=Cube
+          0.,           0.,           5.
+          0.,           0.,           0.,           0.,           0.,           1., 90.
+*End Instance
+*Elset, elset=#02:Second, instance=Cube-2
+ 1
+*End Assembly
+""")
+
+def convert(text, **kwargs):
+    out = io.StringIO()
+    inp = a2d.ParseAbaqus(io.StringIO(text), progress=False)
+    a2d.WriteDynaFromAbaqus(16, 'test.inp', inp, out, progress=False, **kwargs)
+    lines = out.getvalue().splitlines()
+    del lines[2] # timestamp
+    return lines
+
+def test_write_instances():
+    lines = convert(ASSEMBLY)
+    assert lines.count('*NODE') == 2
+    assert '      16 -1.00000000e+00  6.12323400e-17  6.00000000e+00' in lines
+    assert '       2       2      13      14      15      16       9      10      11      12' in lines
+    assert lines[-2] == '*END'
+
+def test_write_jobs():
+    assert convert(ASSEMBLY, jobs=2) == convert(ASSEMBLY)
+
+def test_write_jobs_chunked():
+    assert convert(ASSEMBLY, jobs=2, chunk=3) == convert(ASSEMBLY)
+
+def test_write_progress_chunks():
+    done = []
+    progress = a2d.Progress('', interval=0, callback=lambda p: done.append(p.done))
+    inp = a2d.ParseAbaqus(io.StringIO(SIMPLE), progress=False)
+    a2d.WriteDynaFromAbaqus(9, 'test.inp', inp, io.StringIO(),
+                            progress=progress, chunk=3)
+    # 8 nodes in chunks of 3, then the element
+    assert done[:4] == [3, 6, 8, 9]
+
+def test_write_include_parts(tmp_path):
+    inp = a2d.ParseAbaqus(io.StringIO(ASSEMBLY), progress=False)
+    out = io.StringIO()
+    a2d.WriteDynaFromAbaqus(16, 'test.inp', inp, out, progress=False,
+                            include=lambda name: str(tmp_path / (name + '.k')))
+    lines = out.getvalue().splitlines()
+    assert lines.count('*INCLUDE_TRANSFORM') == 2
+    i = lines.index('*DEFINE_TRANSFORMATION')
+    assert lines[i:i + 3] == ['*DEFINE_TRANSFORMATION', '1', 'TRANSL,1.0,2.0,3.0']
+    assert lines[i + 4].endswith('Cube.k')
+    assert lines[i + 5:i + 9] == ['0,0,0,0,0,0,0', '0', '1.0,1.0,1.0,,0', '1']
+    i = lines.index('*DEFINE_TRANSFORMATION', i + 1)
+    assert lines[i:i + 5] == ['*DEFINE_TRANSFORMATION', '2',
+                              'ROTATE,0.0,0.0,1.0,0.0,0.0,0.0,90.0',
+                              'TRANSL,0.0,0.0,5.0', '*INCLUDE_TRANSFORM']
+    assert lines[i + 6:i + 10] == ['8,1,1,0,0,0,0', '0', '1.0,1.0,1.0,,0', '2']
+    assert '*NODE' not in lines
+    part = (tmp_path / 'Cube.k').read_text().splitlines()
+    assert part.count('*NODE') == 1
+    assert '       1       1       5       6       7       8       1       2       3       4' in part
+
+def test_write_set_lines():
+    lines = convert(ASSEMBLY.replace(' 5, 8, 1\n', ' 1, 9, 1\n'),
+                    generate_sets=False)
+    i = lines.index('*SET_NODE')
+    assert lines[i + 1:i + 4] == [
+        '         1',
+        '         1         2         3         4         5         6         7         8',
+        '         9']
+
+def test_write_set_generate():
+    text = ASSEMBLY.replace(' 5, 8, 1\n', ' 1, 9, 1\n')
+    lines = convert(text)
+    i = lines.index('*SET_NODE_GENERATE')
+    assert lines[i + 1:i + 3] == ['         1', '         1         9']
+    # a single member is shorter as a list
+    assert lines[lines.index('*SET_SOLID') + 2] == '         2'
+
+def test_select(tmp_path):
+    import pytest
+    text = ASSEMBLY.replace('*Assembly', """*Part, name=Other
+*Node
+      1,           0.,           0.,           0.
+*End Part
+*Assembly""").replace('*End Assembly', """*Instance, name=Other-1, part=Other
+*End Instance
+*End Assembly""")
+    select = a2d.Selection(instances=['Cube-2'])
+    inp = select.apply(a2d.ParseAbaqus(io.StringIO(text), progress=False))
+    assert list(inp.instance) == ['Cube-2']
+    assert list(inp.part) == ['Cube']
+    assert list(inp.set['element']) == ['#02:Second']
+    assert list(inp.set['node']) == []
+    source = tmp_path / 'model.inp'
+    source.write_text(text)
+    with open(str(source)) as f:
+        index = a2d.KeywordIndex.for_file(f.name, save=False)
+        assert [index.entries[k].keyword for k in sorted(select.skipped(index))
+                ] == ['NODE', 'NSET']
+        mapped = a2d.ParseAbaqus(f, progress=False, select=select)
+    assert list(mapped.part) == ['Cube']
+    assert list(mapped.set['element']) == ['#02:Second']
+    assert mapped.count['*NODE'] == 2
+    select = a2d.Selection(parts=['Cube'], sets=['Top'])
+    with open(str(source)) as f:
+        inp = a2d.ParseAbaqus(f, progress=False, select=select)
+    assert list(inp.instance) == ['Cube-1', 'Cube-2']
+    assert list(inp.set['node']) == ['#01:Top']
+    assert list(inp.set['element']) == []
+    for select in (a2d.Selection(instances=['Nope']),
+                   a2d.Selection(instances=['Cube-1'], parts=['Cub'])):
+        with open(str(source)) as f:
+            with pytest.raises(ValueError):
+                a2d.ParseAbaqus(f, progress=False, select=select)
+
+def test_compressed_files(tmp_path):
+    import gzip
+    source = tmp_path / 'model.inp.gz'
+    source.write_bytes(gzip.compress(ASSEMBLY.encode()))
+    expected = convert(ASSEMBLY)
+    for worker in (None, 'thread', 'process'):
+        for ext in ('.gz', '.bz2', '.xz'):
+            output = str(tmp_path / ('model.k' + ext))
+            with a2d.open_input(str(source)) as fin:
+                assert fin.name == str(source)
+                inp = a2d.ParseAbaqus(fin, progress=False)
+            with a2d.open_output(output, 1, worker) as fout:
+                a2d.WriteDynaFromAbaqus(16, 'test.inp', inp, fout,
+                                        progress=False)
+            with a2d.open_input(output) as f:
+                lines = f.read().splitlines()
+            del lines[2]
+            assert lines == expected
+    assert a2d.part_include_path('out/model.k.gz', 'Cube') == \
+        'out/model_Cube.k'
+
+def test_convert_unnamed_streams():
+    out = io.StringIO()
+    a2d.convert(io.StringIO(ASSEMBLY), out, progress=False)
+    lines = out.getvalue().splitlines()
+    assert lines[1] == '$ Auto-translated by abaqus2dyna.py'
+    del lines[2]
+    assert lines[2:] == convert(ASSEMBLY)[2:]
+    args = a2d.cmdline(['-', '-o', '-'])
+    assert args.input == '-' and args.output is None
+
+def test_convert_batch(tmp_path):
+    (tmp_path / 'a.inp').write_text(ASSEMBLY)
+    (tmp_path / 'b.inp').write_text(ASSEMBLY.replace('part=Cube', 'part=Nope'))
+    (tmp_path / 'list.txt').write_text('# inputs\n{0}/b.inp\n\n{0}/a.inp\n'
+                                       .format(tmp_path))
+    inputs = a2d.expand_inputs([str(tmp_path / '*.inp'),
+                                '@' + str(tmp_path / 'list.txt')])
+    assert inputs == [str(tmp_path / 'a.inp'), str(tmp_path / 'b.inp')]
+    assert a2d.batch_output('x/a.inp.gz', '{dir}/out/{stem}.k') == \
+        'x/out/a.k'
+    files = [(i, a2d.batch_output(i, '{dir}/out/{stem}.k')) for i in inputs]
+    for jobs in (1, 2):
+        results = sorted(a2d.convert_batch(files, jobs))
+        assert [i.error is None for i in results] == [True, False]
+        assert results[0].nodes == 16 and results[0].elements == 2
+        assert 'KeyError' in results[1].error
+        assert (tmp_path / 'out' / 'a.k').exists()
+        assert not (tmp_path / 'out' / 'b.k').exists()
+
+def test_write_jobs_pickled(monkeypatch):
+    # the formatting pool without shared memory, as before Python 3.8
+    monkeypatch.setattr(a2d, 'shared_memory', None)
+    assert convert(ASSEMBLY, jobs=2, chunk=3) == convert(ASSEMBLY)